@@ -0,0 +1,53 @@
+"""Microbenchmark of foreground compositing: float64 place_fg_to_bg of the original app vs aug.place_fg_to_bg.
+
+Run from the repository root: python benchmarks/bench_blend.py [size]
+"""
+import os
+import sys
+import timeit
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import aug  # noqa: E402
+
+
+def place_fg_to_bg_float64(fg, fg_mask, bg, x, y, edge_smoothing_ksize=0, opacity=1.0):
+    """Original implementation with 3 channel mask, kept as reference"""
+    sec_h, sec_w, _ = fg.shape
+    bg_crop = bg[y : y + sec_h, x : x + sec_w, :]
+    if edge_smoothing_ksize > 0:
+        if edge_smoothing_ksize % 2 == 0:
+            edge_smoothing_ksize += 1
+        fg_mask = cv2.GaussianBlur(fg_mask, (edge_smoothing_ksize, edge_smoothing_ksize), 0)
+    fg_mask = fg_mask / 255.0 * opacity
+    combined_crop = (fg * fg_mask) + (bg_crop * (1 - fg_mask))
+    bg[y : y + sec_h, x : x + sec_w, :] = combined_crop
+
+
+def main(size=1500, ksize=7, opacity=0.9, repeat=5):
+    rng = np.random.default_rng(0)
+    fg = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    mask = np.zeros((size, size), np.uint8)
+    cv2.circle(mask, (size // 2, size // 2), size * 7 // 15, 255, -1)
+    mask3 = np.dstack([mask] * 3)
+    bg = rng.integers(0, 256, (size + 200, size + 200, 3), dtype=np.uint8)
+
+    old_bg, new_bg = bg.copy(), bg.copy()
+    place_fg_to_bg_float64(fg, mask3, old_bg, 10, 10, ksize, opacity)
+    aug.place_fg_to_bg(fg, mask, new_bg, 10, 10, ksize, opacity)
+    max_diff = int(np.abs(old_bg.astype(np.int16) - new_bg).max())
+    assert max_diff <= 1, f"max pixel difference {max_diff} > 1"
+
+    timings = {
+        "float64": lambda: place_fg_to_bg_float64(fg, mask3, old_bg, 10, 10, ksize, opacity),
+        "place_fg_to_bg": lambda: aug.place_fg_to_bg(fg, mask, new_bg, 10, 10, ksize, opacity),
+    }
+    print(f"foreground {size}x{size}, edge_smoothing_ksize={ksize}, opacity={opacity}, max pixel difference {max_diff}")
+    for name, func in timings.items():
+        seconds = min(timeit.repeat(func, number=repeat, repeat=3)) / repeat
+        print(f"{name:>16}: {1000 * seconds:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,63 @@
+"""Microbenchmark of spatial foreground augmentations: imgaug Sequential of the original app vs aug.SpatialAugs.
+
+Run from the repository root: python benchmarks/bench_spatial.py
+"""
+import os
+import sys
+import timeit
+import cv2
+import imgaug.augmenters as iaa
+import numpy as np
+from imgaug.augmentables.segmaps import SegmentationMapsOnImage
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import aug  # noqa: E402
+
+
+def imgaug_spatial(fliplr, flipud, rotate, resize):
+    """Original implementation, kept as reference"""
+    return iaa.Sequential(
+        [iaa.Fliplr(fliplr), iaa.Flipud(flipud), iaa.Rotate(rotate, fit_output=True), iaa.Resize(resize)],
+        random_order=True,
+    )
+
+
+def apply_imgaug(seq, image, mask):
+    segmap = SegmentationMapsOnImage(mask, shape=mask.shape)
+    image, segmap = seq(image=image, segmentation_maps=segmap)
+    return image, segmap.get_arr()
+
+
+def spatial_augs(fliplr, flipud, rotate, resize):
+    spatial = aug.SpatialAugs()
+    spatial.fliplr, spatial.flipud, spatial.rotate, spatial.scale = fliplr, flipud, rotate, resize
+    return spatial
+
+
+def main(repeat=50):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (400, 300, 3), dtype=np.uint8)
+    mask = np.zeros((400, 300), np.uint8)
+    cv2.ellipse(mask, (150, 200), (140, 190), 0, 0, 360, 255, -1)
+
+    # output shapes agree with imgaug for deterministic settings
+    for rotate, resize in [(90, 1.0), (-45, 1.0), (0, 150), (0, 0.5)]:
+        expected = apply_imgaug(imgaug_spatial(0, 0, rotate, resize), image, mask)[1].shape
+        actual = spatial_augs(0, 0, rotate, resize)(image, mask)[1].shape
+        assert abs(expected[0] - actual[0]) <= 1 and abs(expected[1] - actual[1]) <= 1, (rotate, resize, expected, actual)
+
+    # default augs.yaml spatial config
+    config = (0.5, 0.5, (-90, 90), (0.8, 1.5))
+    seq, spatial = imgaug_spatial(*config), spatial_augs(*config)
+    timings = {
+        "imgaug": lambda: apply_imgaug(seq, image, mask),
+        "SpatialAugs": lambda: spatial(image, mask),
+    }
+    print(f"sprite {image.shape[1]}x{image.shape[0]}, Fliplr/Flipud 0.5, Rotate (-90, 90), Resize (0.8, 1.5)")
+    for name, func in timings.items():
+        seconds = min(timeit.repeat(func, number=repeat, repeat=3)) / repeat
+        print(f"{name:>12}: {1000 * seconds:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
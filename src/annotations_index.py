@@ -0,0 +1,58 @@
+import os
+import json
+import pickle
+import hashlib
+import supervisely as sly
+
+from label_store import LabelStore
+
+
+class AnnotationsIndex:
+    """Local copy of project labels kept between app runs.
+
+    Every dataset is stored in its own file (infos of labeled images and LabelStore) together
+    with a key made of dataset update time, items count and project meta, only datasets with
+    changed key are downloaded again.
+    """
+
+    def __init__(self, index_dir, meta: sly.ProjectMeta):
+        self.index_dir = index_dir
+        sly.fs.mkdir(index_dir)
+        meta_str = json.dumps(meta.to_json(), sort_keys=True)
+        self._meta = meta
+        self._meta_hash = hashlib.sha1(meta_str.encode("utf-8")).hexdigest()
+
+    def get_dataset(self, api: sly.Api, dataset: sly.DatasetInfo, progress: sly.Progress):
+        """Returns (image_infos, label_store) of the dataset, from disk if dataset was not changed"""
+        path = os.path.join(self.index_dir, f"{dataset.id}.pkl")
+        key = [dataset.updated_at, dataset.items_count, self._meta_hash, sly.__version__]
+        if sly.fs.file_exists(path):
+            try:
+                with open(path, "rb") as file:
+                    data = pickle.load(file)
+                if data["key"] == key:
+                    progress.iters_done_report(dataset.items_count)
+                    return data["images"], data["labels"]
+            except Exception as e:
+                sly.logger.warning(f"Annotations index of dataset {dataset.name!r} is broken", extra={"error": repr(e)})
+
+        images, stores = [], []
+        for batch in sly.batched(api.image.get_list(dataset.id)):
+            image_ids = [image_info.id for image_info in batch]
+            ann_infos = api.annotation.download_batch(dataset.id, image_ids)
+            batch_images, batch_anns = [], []
+            for image_info, ann_info in zip(batch, ann_infos):
+                ann = sly.Annotation.from_json(ann_info.annotation, self._meta)
+                if len(ann.labels) > 0:
+                    batch_images.append(image_info)
+                    batch_anns.append(ann)
+            images.extend(batch_images)
+            stores.append(LabelStore.from_annotations(self._meta, [info.id for info in batch_images], batch_anns))
+            progress.iters_done_report(len(batch))
+        labels = LabelStore.concatenate(self._meta, stores)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump({"key": key, "images": images, "labels": labels}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return images, labels
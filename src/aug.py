@@ -1,15 +1,15 @@
+import os
 import cv2
 import random
+import hashlib
+import yaml
+import imgaug
 import imgaug.augmenters as iaa
 from imgaug.augmentables.segmaps import SegmentationMapsOnImage
 from ast import literal_eval
 import numpy as np
 import supervisely as sly
 import albumentations as A
-import globals as g
-
-aug_color_fg = None
-aug_spatial_fg = None
 
 
 # imgaug
@@ -28,64 +28,214 @@ name_func_color = {
 }
 
 
-name_func_spatial = {
-    "Fliplr": iaa.Fliplr,
-    "Flipud": iaa.Flipud,
-    "Rotate": iaa.Rotate,
-    # "ElasticTransformation": iaa.ElasticTransformation,
-    "Resize": iaa.Resize,
-}
+spatial_keys = ["Fliplr", "Flipud", "Rotate", "Resize"]  # ElasticTransformation is applied with imgaug
+output_keys = ["size", "max_side", "scale"]
+compositing_modes = ["sequential", "deferred"]
+
+# 1 - alpha below this can not change a blended 8-bit pixel, such pixels hide everything below them
+opaque_margin = np.float32(0.49 / 255)
+
+
+class AugPlan:
+    """Augmentations and objects settings compiled from augs yaml.
+
+    Plan is not changed after compilation, so one plan is shared by all images,
+    threads and worker processes of a run.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.objects = settings["objects"]
+        self.color = init_color_augs(self.objects["augs"]["color"])
+        self.spatial, self.exact_resize_values = init_spatial_augs(self.objects["augs"]["spatial"])
+        self.output = init_output(settings.get("output"))
+        self.compositing = self.objects.get("compositing", "sequential")
+        if self.compositing not in compositing_modes:
+            raise ValueError(f"Unknown compositing mode {self.compositing!r}, supported: {compositing_modes}")
+
+    @property
+    def use_exact_resize(self):
+        return self.exact_resize_values is not None
+
+
+_plans = {}  # sha1 of augs yaml -> AugPlan
 
 
-def init_fg_augs(settings):
-    init_color_augs(settings["objects"]["augs"]["color"])
-    init_spatial_augs(settings["objects"]["augs"]["spatial"])
+def reseed(seed=None):
+    """Seeds all random generators used by synthesis, random seed if None"""
+    if seed is None:
+        seed = int.from_bytes(os.urandom(4), "little")
+    random.seed(seed)
+    # first imgaug.seed creates its global generator from np.random, seed numpy after it
+    imgaug.seed(seed)
+    np.random.seed(seed)
 
 
-def init_color_augs(data):
-    global aug_color_fg
+def compile_plan(augs_yaml: str) -> AugPlan:
+    key = hashlib.sha1(augs_yaml.encode("utf-8")).hexdigest()
+    plan = _plans.get(key)
+    if plan is None:
+        sly.logger.info("Init augs from yaml file")
+        plan = AugPlan(yaml.safe_load(augs_yaml))
+        _plans[key] = plan
+    return plan
+
+
+def init_color_augs(data) -> A.Compose:
     augs = []
     for key, value in data.items():
-        for key, value in data.items():
-            if key not in name_func_color:
-                sly.logger.warning(f"Aug {key} not found, skipped")
-                continue
+        if key not in name_func_color:
+            sly.logger.warning(f"Aug {key} not found, skipped")
+            continue
         augs.append(name_func_color[key]())
-    aug_color_fg = A.Compose(augs)
+    return A.Compose(augs)
+
+
+class SpatialAugs:
+    """Fliplr, Flipud, Rotate (fit_output) and Resize applied to image and mask as a single affine warp.
+
+    Values have the same meaning as in imgaug: flips take probability, Rotate and Resize take
+    a number, (min, max) range or a list of choices. Float Resize values are scale factors,
+    int values are sizes in pixels (image becomes size x size). Flips and rotation are applied
+    in random order, uniform resize commutes with both, resize to pixels is applied before or
+    after rotation at random.
+    """
+
+    def __init__(self):
+        self.fliplr = 0
+        self.flipud = 0
+        self.rotate = 0
+        self.scale = 1
+        self.elastic = None
+
+    def __call__(self, image, mask):
+        flip = np.eye(2)
+        if random.random() < self.fliplr:
+            flip = np.diag([-1.0, 1.0]) @ flip
+        if random.random() < self.flipud:
+            flip = np.diag([1.0, -1.0]) @ flip
+        angle = np.deg2rad(sample_value(self.rotate))
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        if random.random() < 0.5:
+            transform = rotation @ flip
+        else:
+            transform = flip @ rotation
+        size = sample_resize(self.scale)
+        if isinstance(size, int):
+            h, w = mask.shape[:2]
+            if random.random() < 0.5:
+                transform = transform @ np.diag([size / w, size / h])
+            else:
+                out_w, out_h = get_fitted_size(transform, w, h)
+                transform = np.diag([size / out_w, size / out_h]) @ transform
+        else:
+            transform = size * transform
+
+        if np.allclose(transform, np.eye(2)):
+            pass
+        elif np.allclose(np.abs(transform), np.eye(2)):
+            # flips only
+            flip_code = {(-1, 1): 1, (1, -1): 0, (-1, -1): -1}[(round(transform[0, 0]), round(transform[1, 1]))]
+            image, mask = cv2.flip(image, flip_code), cv2.flip(mask, flip_code)
+        else:
+            image, mask = warp(image, mask, transform)
+
+        if self.elastic is not None:
+            segmap = SegmentationMapsOnImage(mask, shape=mask.shape)
+            image, segmap = self.elastic(image=image, segmentation_maps=segmap)
+            mask = segmap.get_arr()
+        return image, mask
+
+
+def sample_value(value):
+    if isinstance(value, tuple):
+        return random.uniform(*value)
+    if isinstance(value, list):
+        return random.choice(value)
+    return value
+
+
+def sample_resize(value):
+    """Resize value as in imgaug: int is size in pixels, float is scale factor"""
+    if isinstance(value, tuple) and all(isinstance(val, int) for val in value):
+        return random.randint(*value)
+    return sample_value(value)
+
+
+def get_fitted_size(transform: np.ndarray, w, h):
+    """(width, height) of the bbox of w x h image after 2x2 linear transform"""
+    corners = transform @ np.array([[0, w, 0, w], [0, 0, h, h]], np.float64)
+    return corners[0].max() - corners[0].min(), corners[1].max() - corners[1].min()
+
+
+def warp(image, mask, transform: np.ndarray):
+    """Applies 2x2 linear transform around the center, output is enlarged to fit the whole result"""
+    h, w = mask.shape[:2]
+    fitted_w, fitted_h = get_fitted_size(transform, w, h)
+    out_w, out_h = max(1, int(np.round(fitted_w))), max(1, int(np.round(fitted_h)))
+    # pixel centers: dst = A @ (src + 0.5 - src_center) + dst_center - 0.5
+    shift = transform @ (0.5 - np.array([w / 2, h / 2])) + np.array([out_w / 2, out_h / 2]) - 0.5
+    matrix = np.hstack([transform, shift[:, np.newaxis]])
+    image = cv2.warpAffine(image, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    mask = cv2.warpAffine(mask, matrix, (out_w, out_h), flags=cv2.INTER_NEAREST,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return image, mask
 
 
 def init_spatial_augs(data):
-    global aug_spatial_fg
-    augs = []
+    spatial = SpatialAugs()
+    exact_resize_values = None
     for key, value in data.items():
         if key == "ElasticTransformation":
             alpha = literal_eval(value["alpha"])
             sigma = literal_eval(value["sigma"])
-            augs.append(iaa.ElasticTransformation(alpha=alpha, sigma=sigma))
+            spatial.elastic = iaa.ElasticTransformation(alpha=alpha, sigma=sigma)
             continue
-        if key not in name_func_spatial:
+        if key not in spatial_keys:
             sly.logger.warning(f"Aug {key} not found, skipped")
             continue
 
         parsed_value = value
 
         if key == "Resize" and isinstance(parsed_value, dict):
-            g.use_exact_resize = True
-            g.exact_resize_values = convert_to_tuple(parsed_value)
+            exact_resize_values = convert_to_tuple(parsed_value)
             continue
 
         if type(value) is str:
             parsed_value = literal_eval(value)
 
-        if key == "Rotate":
-            a = iaa.Rotate(rotate=parsed_value, fit_output=True)
-        else:
-            if key == "Resize" and any([not(value > 0) for value in parsed_value]):
+        if key == "Fliplr":
+            spatial.fliplr = parsed_value
+        elif key == "Flipud":
+            spatial.flipud = parsed_value
+        elif key == "Rotate":
+            spatial.rotate = parsed_value
+        elif key == "Resize":
+            values = parsed_value if isinstance(parsed_value, (tuple, list)) else [parsed_value]
+            if any([not(value > 0) for value in values]):
                 sly.logger.warning("Cannot resize image to 0% of its original size, skipping")
                 continue
-            a = name_func_spatial[key](parsed_value)
-        augs.append(a)
-    aug_spatial_fg = iaa.Sequential(augs, random_order=True)
+            spatial.scale = parsed_value
+    return spatial, exact_resize_values
+
+
+def init_output(data):
+    """Output resolution: {"size": (height, width)}, {"max_side": pixels}, {"scale": (min, max)} or None"""
+    if not data:
+        return None
+    keys = [key for key in output_keys if key in data]
+    if len(keys) != 1:
+        raise ValueError(f"Use exactly one of output resolution options: {output_keys}")
+    key = keys[0]
+    value = data[key]
+    if type(value) is str:
+        value = literal_eval(value)
+    if key == "max_side":
+        return {key: int(value)}
+    if key == "size":
+        return {key: tuple(map(int, value))}
+    return {key: tuple(map(float, value))}
 
 
 def convert_to_tuple(value):
@@ -96,21 +246,56 @@ def convert_to_tuple(value):
     return {key: convert(val) for key, val in value.items()}
 
 
-def apply_to_foreground(image, mask):
+def get_output_size(plan: AugPlan, height, width):
+    if plan.output is None:
+        return height, width
+    if "size" in plan.output:
+        return plan.output["size"]
+    if "max_side" in plan.output:
+        factor = min(1.0, plan.output["max_side"] / max(height, width))
+    else:
+        factor = random.uniform(*plan.output["scale"])
+    return max(1, int(round(height * factor))), max(1, int(round(width * factor)))
+
+
+def resize_background(plan: AugPlan, image, max_side=None):
+    """Writable background of output resolution and its (vertical, horizontal) scale factors,
+    max_side additionally limits the resolution, e.g. for preview"""
+    height, width = image.shape[:2]
+    out_height, out_width = get_output_size(plan, height, width)
+    if max_side is not None and max(out_height, out_width) > max_side:
+        factor = max_side / max(out_height, out_width)
+        out_height, out_width = max(1, int(round(out_height * factor))), max(1, int(round(out_width * factor)))
+    if (out_height, out_width) == (height, width):
+        return image.copy(), (1.0, 1.0)
+    interpolation = cv2.INTER_AREA if out_height * out_width < height * width else cv2.INTER_CUBIC
+    image = cv2.resize(image, (out_width, out_height), interpolation=interpolation)
+    return image, (out_height / height, out_width / width)
+
+
+def scale_foreground(image, mask, scale):
+    """Scales object together with background, so objects keep their size relative to background"""
+    if scale == (1.0, 1.0):
+        return image, mask
+    height = max(1, int(round(mask.shape[0] * scale[0])))
+    width = max(1, int(round(mask.shape[1] * scale[1])))
+    interpolation = cv2.INTER_AREA if height * width < mask.size else cv2.INTER_CUBIC
+    image = cv2.resize(image, (width, height), interpolation=interpolation)
+    mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+    return image, mask
+
+
+def apply_to_foreground(plan: AugPlan, image, mask):
     if image.shape[:2] != mask.shape[:2]:
         raise ValueError(
             f"Image ({image.shape}) and mask ({mask.shape}) have different resolutions"
         )
 
-    # apply color augs
-    augmented = aug_color_fg(image=image, mask=mask)
-    image_aug = augmented["image"]
-    mask_aug = augmented["mask"]
+    # apply color augs, they do not change mask
+    image_aug = plan.color(image=image)["image"]
 
     # apply spatial augs
-    segmap = SegmentationMapsOnImage(mask_aug, shape=mask_aug.shape)
-    image_aug, segmap_aug = aug_spatial_fg(image=image_aug, segmentation_maps=segmap)
-    mask_aug = segmap_aug.get_arr()
+    image_aug, mask_aug = plan.spatial(image_aug, mask)
     return image_aug, mask_aug
 
 
@@ -125,18 +310,21 @@ def find_origin(image_shape, mask_shape):
     return (x, y)
 
 
-def resize_foreground_to_fit_into_image(dest_image, image, mask):
+def resize_foreground_to_fit_into_image(plan: AugPlan, dest_image, image, mask, scale=(1.0, 1.0)):
+    """Exact resize bounds are given for original background resolution and are multiplied by scale"""
     img_h, img_w, _ = dest_image.shape
-    mask_h, mask_w, _ = mask.shape
+    mask_h, mask_w = mask.shape
 
-    if g.use_exact_resize:
-        settings = g.exact_resize_values
+    if plan.use_exact_resize:
+        settings = plan.exact_resize_values
         height = settings["height"]
         width = settings["width"]
 
         if height != "keep-aspect-ratio":
+            height = [max(1, int(round(value * scale[0]))) for value in height]
             height = (min(height[0], img_h), min(height[1], img_h))
         if width != "keep-aspect-ratio":
+            width = [max(1, int(round(value * scale[1]))) for value in width]
             width = (min(width[0], img_w), min(width[1], img_w))
 
         # Ensure that the mask fits into the image
@@ -150,15 +338,26 @@ def resize_foreground_to_fit_into_image(dest_image, image, mask):
             settings = {"height": "keep-aspect-ratio", "width": img_w}
 
     if settings is not None:
-        aug = iaa.Resize(settings)
-        segmap = SegmentationMapsOnImage(mask, shape=mask.shape)
-        image_aug, segmap_aug = aug(image=image, segmentation_maps=segmap)
-        mask_aug = segmap_aug.get_arr()
+        height, width = sample_size(settings["height"]), sample_size(settings["width"])
+        if height == "keep-aspect-ratio":
+            height = int(np.round(width * mask_h / mask_w))
+        if width == "keep-aspect-ratio":
+            width = int(np.round(height * mask_w / mask_h))
+        size = (max(1, width), max(1, height))
+        image_aug = cv2.resize(image, size, interpolation=cv2.INTER_CUBIC)
+        mask_aug = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
         return image_aug, mask_aug
     else:
         return image, mask
 
 
+def sample_size(value):
+    """Size in pixels: number, inclusive (min, max) range or keep-aspect-ratio"""
+    if isinstance(value, tuple):
+        return random.randint(*value)
+    return value
+
+
 def place_fg_to_bg(
     fg: np.ndarray,
     fg_mask: np.ndarray,
@@ -170,7 +369,12 @@ def place_fg_to_bg(
 ):
     sec_h, sec_w, _ = fg.shape
     bg_crop = bg[y : y + sec_h, x : x + sec_w, :]
+    alpha = get_alpha(fg_mask, edge_smoothing_ksize, opacity)
+    blend(bg_crop, fg, alpha)
+
 
+def get_alpha(fg_mask: np.ndarray, edge_smoothing_ksize: int = 0, opacity: float = 1.0) -> np.ndarray:
+    """Single channel float32 alpha in [0, 1] from single channel uint8 mask"""
     # Blur the edges of the mask
     if edge_smoothing_ksize > 0:
         if edge_smoothing_ksize % 2 == 0:
@@ -180,9 +384,34 @@ def place_fg_to_bg(
         )
 
     # Normalize to [0, 1] and apply opacity
-    fg_mask = fg_mask / 255.0 * opacity
-
-    # Blend the images
-    combined_crop = (fg * fg_mask) + (bg_crop * (1 - fg_mask))
-
-    bg[y : y + sec_h, x : x + sec_w, :] = combined_crop
+    return fg_mask.astype(np.float32) * np.float32(opacity / 255.0)
+
+
+def composite_layers(dst: np.ndarray, layers):
+    """Blends layers (image, alpha, x, y) into dst from bottom to top in one pass.
+
+    Result is identical to place_fg_to_bg for every layer in order: pixels under opaque pixels
+    of upper layers are not blended and fully hidden layers are skipped.
+    """
+    opaque = np.zeros(dst.shape[:2], bool)
+    visible_layers = []
+    for fg, alpha, x, y in reversed(layers):
+        h, w = alpha.shape
+        hidden = opaque[y:y + h, x:x + w]
+        visible = (alpha > 0) & ~hidden
+        if np.any(visible):
+            rows, cols = np.flatnonzero(np.any(visible, axis=1)), np.flatnonzero(np.any(visible, axis=0))
+            top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            visible_alpha = np.where(visible[top:bottom, left:right], alpha[top:bottom, left:right], np.float32(0))
+            visible_layers.append((fg[top:bottom, left:right], visible_alpha, x + left, y + top))
+        hidden |= alpha >= 1 - opaque_margin
+
+    for fg, alpha, x, y in reversed(visible_layers):
+        h, w = alpha.shape
+        blend(dst[y:y + h, x:x + w], fg, alpha)
+
+
+def blend(dst: np.ndarray, src: np.ndarray, alpha: np.ndarray):
+    """dst = src * alpha + dst * (1 - alpha), dst (view of background) is modified in place"""
+    combined = cv2.blendLinear(src, dst, alpha, 1.0 - alpha)
+    np.copyto(dst, combined)
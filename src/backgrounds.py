@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import supervisely as sly
+
+from bg_catalogue import BackgroundCatalogue
+from image_cache import ImageCache
+
+
+class BackgroundProvider:
+    """Serves random decoded backgrounds for synthesis.
+
+    Upcoming picks are downloaded and decoded by background threads. Decoded images are
+    kept in a LRU cache limited by size in bytes, downloaded files are kept in the shared
+    ImageCache and survive between preview and generate runs. Returned images are read only,
+    copy them before drawing.
+    """
+
+    default_prefetch = 4
+
+    def __init__(self, api: sly.Api, image_cache: ImageCache, max_bytes=2 * 1024 ** 3, prefetch=default_prefetch):
+        self._api = api
+        self._image_cache = image_cache
+        self._max_bytes = max_bytes
+        self._prefetch = prefetch
+        self._executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+        self._lock = threading.Lock()
+        self._images = OrderedDict()  # image id -> decoded image
+        self._images_bytes = 0
+        self._pending = deque()  # (bg_info, future)
+        self._bg_images: BackgroundCatalogue = None
+
+    def set_images(self, bg_images: BackgroundCatalogue):
+        """Source of backgrounds, any object with sample() returning BackgroundRef"""
+        if bg_images is self._bg_images:
+            return
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._bg_images = bg_images
+
+    def next(self):
+        """Returns (bg_info, image) for a random background"""
+        if self._bg_images is None:
+            raise ValueError("There are no background images")
+        while len(self._pending) <= self._prefetch:
+            bg_info = self._bg_images.sample()
+            self._pending.append((bg_info, self._executor.submit(self._load, bg_info)))
+        bg_info, future = self._pending.popleft()
+        return bg_info, future.result()
+
+    def close(self):
+        """Cancels upcoming picks and waits for downloads in progress"""
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def _load(self, bg_info):
+        with self._lock:
+            img = self._images.get(bg_info.id)
+            if img is not None:
+                self._images.move_to_end(bg_info.id)
+                return img
+
+        img = self._image_cache.read(self._api, bg_info)
+        img.flags.writeable = False
+
+        with self._lock:
+            if bg_info.id not in self._images:
+                self._images[bg_info.id] = img
+                self._images_bytes += img.nbytes
+            while self._images_bytes > self._max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._images_bytes -= evicted.nbytes
+        return img
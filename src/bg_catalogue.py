@@ -0,0 +1,169 @@
+import random
+import threading
+from collections import namedtuple
+import numpy as np
+import supervisely as sly
+
+from label_store import LabelStore
+
+BackgroundRef = namedtuple("BackgroundRef", ["id", "name", "hash", "height", "width", "labels"])
+
+
+class BackgroundCatalogue:
+    """Ids and sizes of background images kept in compact arrays.
+
+    Images are listed page by page in a background thread, so backgrounds can be drawn
+    from the pages loaded so far while the rest of the project is still being listed.
+    If meta is given, annotations are downloaded in batches together with images and kept
+    in LabelStore chunks with polygons already converted to bitmaps (labels of other shapes
+    are ignored), every BackgroundRef then carries its labels.
+    """
+
+    def __init__(self, api: sly.Api, project_id, dataset_names, meta: sly.ProjectMeta = None, page_size=10000,
+                 chunk_size=500):
+        self.project_id = project_id
+        self.dataset_names = list(dataset_names)
+        self.meta = meta
+        self._api = api
+        self._page_size = page_size
+        self._chunk_size = chunk_size
+        self._ids = np.zeros(page_size, np.int64)
+        self._heights = np.zeros(page_size, np.int32)
+        self._widths = np.zeros(page_size, np.int32)
+        self._ext_codes = np.zeros(page_size, np.uint8)
+        self._exts = []  # code -> file extension
+        self._label_chunks = []  # LabelStore of every downloaded chunk of images
+        self._label_chunk = np.zeros(page_size, np.int32)
+        self._label_start = np.zeros(page_size, np.int32)  # first label of image in its chunk store
+        self._label_count = np.zeros(page_size, np.int32)
+        self._bitmap_meta = None
+        if meta is not None:
+            self._bitmap_meta = sly.ProjectMeta(
+                obj_classes=sly.ObjClassCollection(
+                    [obj_class.clone(geometry_type=sly.Bitmap) for obj_class in meta.obj_classes]
+                )
+            )
+        self._count = 0
+        self._done = False
+        self._error = None
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def wait_for_first(self, timeout=None):
+        """Blocks until at least one background is listed or listing is finished, returns count"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._count > 0 or self._done, timeout)
+        self._raise_error()
+        return self._count
+
+    def wait(self):
+        """Blocks until all datasets are listed, returns count"""
+        self._thread.join()
+        self._raise_error()
+        return self._count
+
+    @property
+    def with_labels(self):
+        return self.meta is not None
+
+    def get(self, index) -> BackgroundRef:
+        if index >= self._count:
+            raise IndexError(index)
+        image_id = int(self._ids[index])
+        name = f"{image_id}{self._exts[self._ext_codes[index]]}"
+        labels = None
+        if self.with_labels:
+            store: LabelStore = self._label_chunks[self._label_chunk[index]]
+            start = self._label_start[index]
+            labels = [store.get_label(position) for position in range(start, start + self._label_count[index])]
+        return BackgroundRef(image_id, name, None, int(self._heights[index]), int(self._widths[index]), labels)
+
+    def sample(self) -> BackgroundRef:
+        """Random background among the images listed so far"""
+        if self.wait_for_first() == 0:
+            raise ValueError("There are no background images")
+        return self.get(random.randrange(self._count))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("Failed to list background images") from self._error
+
+    def _fill(self):
+        try:
+            for dataset_name in self.dataset_names:
+                dataset_info = self._api.dataset.get_info_by_name(self.project_id, dataset_name)
+                if dataset_info is None:
+                    sly.logger.warning(f"Background dataset {dataset_name!r} not found")
+                    continue
+                for page in self._api.image.get_list_generator(dataset_info.id, batch_size=self._page_size):
+                    if self.with_labels:
+                        for chunk in sly.batched(page, batch_size=self._chunk_size):
+                            self._append(chunk, self._download_labels(dataset_info.id, chunk))
+                    else:
+                        self._append(page)
+        except Exception as e:
+            self._error = e
+            sly.logger.error("Failed to list background images", extra={"error": repr(e)})
+        finally:
+            with self._changed:
+                self._done = True
+                self._changed.notify_all()
+        sly.logger.info(f"Background images count: {self._count}")
+
+    def _download_labels(self, dataset_id, image_infos) -> LabelStore:
+        ann_infos = self._api.annotation.download_batch(dataset_id, [image_info.id for image_info in image_infos])
+        anns = []
+        for ann_info in ann_infos:
+            ann = sly.Annotation.from_json(ann_info.annotation, self.meta)
+            labels = []
+            for label in ann.labels:
+                obj_class = self._bitmap_meta.get_obj_class(label.obj_class.name)
+                if isinstance(label.geometry, sly.Bitmap):
+                    labels.append(label.clone(obj_class=obj_class))
+                elif isinstance(label.geometry, sly.Polygon):
+                    labels.extend(label.convert(new_obj_class=obj_class))
+            anns.append(ann.clone(labels=labels))
+        return LabelStore.from_annotations(self._bitmap_meta, [info.id for info in image_infos], anns)
+
+    def _append(self, page, labels: LabelStore = None):
+        if len(page) == 0:
+            return
+        start, end = self._count, self._count + len(page)
+        if end > len(self._ids):
+            capacity = max(end, 2 * len(self._ids))
+            for name in ("_ids", "_heights", "_widths", "_ext_codes", "_label_chunk", "_label_start", "_label_count"):
+                array = getattr(self, name)
+                grown = np.zeros(capacity, array.dtype)
+                grown[:start] = array[:start]
+                setattr(self, name, grown)
+        for offset, image_info in enumerate(page):
+            ext = sly.fs.get_file_ext(image_info.name)
+            if ext not in self._exts:
+                self._exts.append(ext)
+            self._ids[start + offset] = image_info.id
+            self._heights[start + offset] = image_info.height or 0
+            self._widths[start + offset] = image_info.width or 0
+            self._ext_codes[start + offset] = self._exts.index(ext)
+        if labels is not None:
+            # labels in store go image by image in the order of the page
+            image_counts = dict(zip(*np.unique(labels.image_ids, return_counts=True)))
+            counts = np.array([image_counts.get(info.id, 0) for info in page], np.int32)
+            self._label_chunk[start:end] = len(self._label_chunks)
+            self._label_start[start:end] = np.cumsum(counts) - counts
+            self._label_count[start:end] = counts
+            self._label_chunks.append(labels)
+        with self._changed:
+            self._count = end  # published after rows are written, readers never see a partial page
+            self._changed.notify_all()
@@ -0,0 +1,36 @@
+import os
+import supervisely as sly
+
+from annotations_index import AnnotationsIndex
+from backgrounds import BackgroundProvider
+from image_cache import ImageCache
+from label_store import LabelStore
+from sampling import build_sampling_index
+from sprites import SpriteBank
+
+image_cache_bytes = 20 * 1024 ** 3  # downloaded source and background images on disk
+backgrounds_cache_bytes = 2 * 1024 ** 3  # decoded backgrounds kept in memory
+
+
+def init_caches(api: sly.Api, data_dir, cache_dir):
+    """Local caches shared by app callbacks and synthetic streams: (sprite_bank, image_cache, backgrounds)"""
+    sprite_bank = SpriteBank(os.path.join(data_dir, "sprite_bank"))
+    image_cache = ImageCache(os.path.join(cache_dir, "images"), image_cache_bytes)
+    backgrounds = BackgroundProvider(api, image_cache, max_bytes=backgrounds_cache_bytes)
+    return sprite_bank, image_cache, backgrounds
+
+
+def load_project_labels(api: sly.Api, project_id, meta: sly.ProjectMeta, cache_dir):
+    """Returns (images_info, label_store, sampling_index) of the project from the local annotations index"""
+    datasets = api.dataset.get_list(project_id)
+    progress = sly.Progress("Cache annotations", sum(dataset.items_count for dataset in datasets))
+    index = AnnotationsIndex(os.path.join(cache_dir, "annotations_index", str(project_id)), meta)
+    images_info = {}
+    stores = []
+    for dataset in datasets:
+        images, labels = index.get_dataset(api, dataset, progress)
+        for image_info in images:
+            images_info[image_info.id] = image_info
+        stores.append(labels)
+    label_store = LabelStore.concatenate(meta, stores)
+    return images_info, label_store, build_sampling_index(label_store)
@@ -0,0 +1,90 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import supervisely as sly
+
+output_formats = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+
+def get_params(output_format, quality=95, png_compression=3):
+    """Extension and cv2.imencode params of the output format"""
+    if output_format not in output_formats:
+        raise ValueError(f"Unknown output format {output_format!r}, supported: {list(output_formats)}")
+    if output_format == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    elif output_format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    else:
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    return output_formats[output_format], params
+
+
+def encode_image(img: np.ndarray, output_format="png", quality=95, png_compression=3) -> np.ndarray:
+    """Encodes RGB image in the calling thread, returns buffer with file contents"""
+    ext, params = get_params(output_format, quality, png_compression)
+    return _encode(img, ext, params)
+
+
+def _encode(img: np.ndarray, ext, params) -> np.ndarray:
+    ok, buffer = cv2.imencode(ext, cv2.cvtColor(img, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise RuntimeError(f"Failed to encode image to {ext}")
+    return buffer
+
+
+class Encoder:
+    """Encodes generated images to files in a thread pool separate from synthesis.
+
+    OpenCV releases GIL while encoding, so threads run in parallel. Encoded size and
+    encode time of every image are logged and summed up in stats.
+    """
+
+    def __init__(self, output_format="png", quality=95, png_compression=3, workers=None):
+        self.ext, self._params = get_params(output_format, quality, png_compression)
+        self._executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1))
+        self._lock = threading.Lock()
+        self._count = 0
+        self._bytes = 0
+        self._seconds = 0.0
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["outputFormat"], state["outputQuality"], state["pngCompression"])
+
+    @property
+    def stats(self):
+        with self._lock:
+            count = max(self._count, 1)
+            return {
+                "images": self._count,
+                "total_mb": round(self._bytes / 1024 ** 2, 2),
+                "mean_kb": round(self._bytes / count / 1024, 2),
+                "mean_encode_ms": round(1000 * self._seconds / count, 2),
+            }
+
+    def submit(self, img: np.ndarray, path):
+        """Future with (encoded size in bytes, encode time in seconds)"""
+        return self._executor.submit(self.encode, img, path)
+
+    def encode(self, img: np.ndarray, path):
+        start = time.perf_counter()
+        buffer = self.to_buffer(img)
+        seconds = time.perf_counter() - start
+        buffer.tofile(path)
+        with self._lock:
+            self._count += 1
+            self._bytes += buffer.size
+            self._seconds += seconds
+        sly.logger.debug(
+            "Image encoded", extra={"image": os.path.basename(path), "size": buffer.size, "encode_ms": round(1000 * seconds, 2)}
+        )
+        return buffer.size, seconds
+
+    def to_buffer(self, img: np.ndarray) -> np.ndarray:
+        return _encode(img, self.ext, self._params)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -1,6 +1,5 @@
 import os
 import sys
-from collections import defaultdict
 
 import supervisely as sly
 from supervisely.app.v1.app_service import AppService
@@ -32,11 +31,17 @@ meta = sly.ProjectMeta.from_json(app.public_api.project.get_meta(project_id))
 if len(meta.obj_classes) == 0:
     raise ValueError("Project should have at least one class")
 
-bg_meta = None
-
 images_info = {}
-anns = {}
-labels = defaultdict(lambda: defaultdict(list))
+label_store = None
+sampling_index = {}
+sprite_bank = None
+
+progress_reporter = None
+
+image_cache = None
+backgrounds = None
+
+preview_inline_bytes = 2 * 1024 ** 2  # larger previews are uploaded to team files
 
 CNT_GRID_COLUMNS = 1
 empty_gallery = {
@@ -53,7 +58,4 @@ empty_gallery = {
         "selectable": False,
         "opacity": 0.5,
     },
-}
-
-use_exact_resize = False
-exact_resize_values = {}
\ No newline at end of file
+}
\ No newline at end of file
@@ -0,0 +1,129 @@
+import os
+import fcntl
+import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+import supervisely as sly
+
+
+class ImageCache:
+    """On-disk cache of downloaded images shared by preview, generate and worker processes.
+
+    Files are addressed by image hash (image id if hash is unknown) and published atomically.
+    When the total size exceeds max_bytes least recently used files are evicted under a file lock.
+    Total size, hit and miss counters are shared with forked workers.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        sly.fs.mkdir(cache_dir)
+        self._lock_path = os.path.join(cache_dir, ".lock")
+        self._hits = multiprocessing.Value("q", 0)
+        self._misses = multiprocessing.Value("q", 0)
+        self._remove_stale_downloads()
+        self._size = multiprocessing.Value("q", sum(size for _, size, _ in self._list_files()))
+
+    @property
+    def stats(self):
+        return {"hits": self._hits.value, "misses": self._misses.value}
+
+    def read(self, api: sly.Api, image_info) -> np.ndarray:
+        try:
+            return sly.image.read(self.get_path(api, image_info))
+        except Exception:
+            # file was evicted by another process between get_path and read
+            return sly.image.read(self.get_path(api, image_info))
+
+    def get_path(self, api: sly.Api, image_info) -> str:
+        key = image_info.hash or str(image_info.id)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        path = os.path.join(self.cache_dir, digest[:2], f"{digest}{sly.fs.get_file_ext(image_info.name)}")
+        if sly.fs.file_exists(path):
+            try:
+                os.utime(path)  # mark as recently used
+            except FileNotFoundError:
+                pass  # evicted by another process, download again
+            else:
+                with self._hits.get_lock():
+                    self._hits.value += 1
+                return path
+
+        with self._misses.get_lock():
+            self._misses.value += 1
+        sly.fs.mkdir(os.path.dirname(path))
+        tmp_path = os.path.join(os.path.dirname(path), f"tmp_{os.getpid()}_{threading.get_ident()}_{os.path.basename(path)}")
+        try:
+            api.image.download_path(image_info.id, tmp_path)
+        except Exception:
+            sly.fs.silent_remove(tmp_path)
+            raise
+        with self._size.get_lock():
+            self._size.value += os.path.getsize(tmp_path)
+        with self._locked():
+            os.replace(tmp_path, path)
+            if self._size.value > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _remove_stale_downloads(self):
+        """Removes partial downloads "tmp_<pid>_..." left by processes that are not running anymore"""
+        with self._locked():
+            for root, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    if not name.startswith("tmp_"):
+                        continue
+                    pid = name.split("_")[1]
+                    if pid.isdigit() and _is_running(int(pid)):
+                        continue
+                    sly.fs.silent_remove(os.path.join(root, name))
+
+    def _list_files(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.startswith(".") or name.startswith("tmp_"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self, keep):
+        """Removes least recently used files until cache takes 90% of max_bytes, size is recounted from disk
+        because other processes write to the same cache"""
+        files = sorted(self._list_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= 0.9 * self.max_bytes:
+                break
+            if path == keep:
+                continue
+            sly.fs.silent_remove(path)
+            total -= size
+        with self._size.get_lock():
+            self._size.value = total
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # process of another user
+    return True
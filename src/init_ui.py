@@ -56,33 +56,6 @@ def init_progress(data):
     data["progressTotalImages"] = 0
 
 
-def refresh_progress(api: sly.Api, task_id, progress: sly.Progress):
-    fields = [
-        {"field": "data.progressPercent", "payload": int(progress.current * 100 / progress.total)},
-        {"field": "data.progressCurrent", "payload": progress.current},
-        {"field": "data.progressTotal", "payload": progress.total},
-    ]
-    api.task.set_fields(task_id, fields)
-
-
-def refresh_progress_preview(api: sly.Api, task_id, progress: sly.Progress):
-    fields = [
-        {"field": "data.progressPercentPreview", "payload": int(progress.current * 100 / progress.total)},
-        {"field": "data.progressCurrentPreview", "payload": progress.current},
-        {"field": "data.progressTotalPreview", "payload": progress.total},
-    ]
-    api.task.set_fields(task_id, fields)
-
-
-def refresh_progress_images(api: sly.Api, task_id, progress: sly.Progress):
-    fields = [
-        {"field": "data.progressPercentImages", "payload": int(progress.current * 100 / progress.total)},
-        {"field": "data.progressCurrentImage", "payload": progress.current},
-        {"field": "data.progressTotalImages", "payload": progress.total},
-    ]
-    api.task.set_fields(task_id, fields)
-
-
 def init_res_project(data, state):
     data["resProjectId"] = None
     state["resProjectName"] = None
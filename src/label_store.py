@@ -0,0 +1,130 @@
+import numpy as np
+import supervisely as sly
+
+import rle
+
+POLYGON = 0
+BITMAP = 1
+RECTANGLE = 2
+OTHER = 3
+
+
+class LabelStore:
+    """Compact storage of project labels in contiguous arrays.
+
+    Per label it keeps class id, image id, bbox (top, left, bottom, right), area and geometry:
+    polygons as [contours count, length of every contour, (row, col) points...] and bitmaps as
+    [height, width, run lengths...] in one int32 buffer. Rare geometries are kept as sly.Label.
+    Labels are converted back to sly.Label only on request.
+    """
+
+    def __init__(self, meta: sly.ProjectMeta):
+        self.meta = meta
+        self.class_names = [obj_class.name for obj_class in meta.obj_classes]
+        self.class_ids = np.zeros(0, np.int32)
+        self.image_ids = np.zeros(0, np.int64)
+        self.bboxes = np.zeros((0, 4), np.int32)
+        self.areas = np.zeros(0, np.float64)
+        self.kinds = np.zeros(0, np.uint8)
+        self.offsets = np.zeros(1, np.int64)  # geometry of label i is data[offsets[i]:offsets[i + 1]]
+        self.data = np.zeros(0, np.int32)
+        self.other = {}  # position -> sly.Label
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    @classmethod
+    def from_annotations(cls, meta: sly.ProjectMeta, image_ids, anns):
+        store = cls(meta)
+        class_indices = {name: idx for idx, name in enumerate(store.class_names)}
+        class_ids, label_image_ids, bboxes, areas, kinds, sizes, chunks = [], [], [], [], [], [], []
+        for image_id, ann in zip(image_ids, anns):
+            for label in ann.labels:
+                label: sly.Label
+                geometry = label.geometry
+                bbox = geometry.to_bbox()
+                if isinstance(geometry, sly.Polygon):
+                    kind = POLYGON
+                    contours = [geometry.exterior_np] + list(geometry.interior_np)
+                    chunk = np.concatenate(
+                        [[len(contours)], [len(contour) for contour in contours]]
+                        + [contour.ravel() for contour in contours]
+                    )
+                elif isinstance(geometry, sly.Bitmap):
+                    kind = BITMAP
+                    chunk = np.concatenate([geometry.data.shape, rle.encode(geometry.data)])
+                elif isinstance(geometry, sly.Rectangle):
+                    kind = RECTANGLE
+                    chunk = np.zeros(0)
+                else:
+                    kind = OTHER
+                    chunk = np.zeros(0)
+                    store.other[len(class_ids)] = label
+                class_ids.append(class_indices[label.obj_class.name])
+                label_image_ids.append(image_id)
+                bboxes.append((bbox.top, bbox.left, bbox.bottom, bbox.right))
+                areas.append(label.area)
+                kinds.append(kind)
+                sizes.append(len(chunk))
+                chunks.append(chunk.astype(np.int32))
+
+        store.class_ids = np.array(class_ids, np.int32)
+        store.image_ids = np.array(label_image_ids, np.int64)
+        store.bboxes = np.array(bboxes, np.int32).reshape(-1, 4)
+        store.areas = np.array(areas, np.float64)
+        store.kinds = np.array(kinds, np.uint8)
+        store.offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        store.data = np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0, np.int32)
+        return store
+
+    @classmethod
+    def concatenate(cls, meta: sly.ProjectMeta, stores):
+        store = cls(meta)
+        stores = [s for s in stores if len(s) > 0]
+        if len(stores) == 0:
+            return store
+        store.class_ids = np.concatenate([s.class_ids for s in stores])
+        store.image_ids = np.concatenate([s.image_ids for s in stores])
+        store.bboxes = np.concatenate([s.bboxes for s in stores])
+        store.areas = np.concatenate([s.areas for s in stores])
+        store.kinds = np.concatenate([s.kinds for s in stores])
+        store.data = np.concatenate([s.data for s in stores])
+        offsets, data_shift, position_shift = [np.zeros(1, np.int64)], 0, 0
+        for s in stores:
+            offsets.append(s.offsets[1:] + data_shift)
+            for position, label in s.other.items():
+                store.other[position + position_shift] = label
+            data_shift += len(s.data)
+            position_shift += len(s)
+        store.offsets = np.concatenate(offsets)
+        return store
+
+    def positions_of_class(self, class_name) -> np.ndarray:
+        if class_name not in self.class_names:
+            return np.zeros(0, np.int64)
+        return np.flatnonzero(self.class_ids == self.class_names.index(class_name))
+
+    def get_label(self, position) -> sly.Label:
+        kind = self.kinds[position]
+        if kind == OTHER:
+            return self.other[position]
+
+        obj_class = self.meta.get_obj_class(self.class_names[self.class_ids[position]])
+        top, left, bottom, right = self.bboxes[position].tolist()
+        chunk = self.data[self.offsets[position]:self.offsets[position + 1]]
+        if kind == POLYGON:
+            contours_count = chunk[0]
+            lengths = chunk[1:1 + contours_count]
+            points = chunk[1 + contours_count:].reshape(-1, 2).tolist()
+            contours, start = [], 0
+            for length in lengths:
+                contours.append([tuple(point) for point in points[start:start + length]])
+                start += length
+            geometry = sly.Polygon(exterior=contours[0], interior=contours[1:])
+        elif kind == BITMAP:
+            h, w = chunk[:2]
+            mask = rle.decode(chunk[2:], (h, w))
+            geometry = sly.Bitmap(mask, origin=sly.PointLocation(row=top, col=left))
+        else:
+            geometry = sly.Rectangle(top, left, bottom, right)
+        return sly.Label(geometry, obj_class)
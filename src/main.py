@@ -1,30 +1,27 @@
 import os
+import base64
+import time
 
 import supervisely as sly
 
 import globals as g
+from aug import compile_plan
+from caches import init_caches, load_project_labels
 from generate import synthesize, update_bg_images
+from workers import synthesize_images
+from encode import Encoder, encode_image, output_formats
 from init_ui import (init_augs, init_classes_stats, init_input_project,
-                     init_progress, init_res_project, refresh_progress_images)
-from postprocess import highlight_instances, postprocess
+                     init_progress, init_res_project)
+from postprocess import (apply_classes_mapping, get_result_meta,
+                         highlight_instances, postprocess, transform)
+from progress_reporter import ProgressReporter
+from upload import Uploader
 
 
 @g.app.callback("cache_annotations")
 @sly.timeit
 def cache_annotations(api: sly.Api, task_id, context, state, app_logger):
-    progress = sly.Progress("Cache annotations", g.project_info.items_count)
-    for dataset in api.dataset.get_list(g.project_id):
-        images = api.image.get_list(dataset.id)
-        for batch in sly.batched(images):
-            image_ids = [image_info.id for image_info in batch]
-            ann_infos = api.annotation.download_batch(dataset.id, image_ids)
-            for image_id, image_info, ann_info in zip(image_ids, batch, ann_infos):
-                ann = sly.Annotation.from_json(ann_info.annotation, g.meta)
-                g.anns[image_id] = ann
-                g.images_info[image_id] = image_info
-                for label in ann.labels:
-                    g.labels[label.obj_class.name][image_id].append(label)
-            progress.iters_done_report(len(batch))
+    g.images_info, g.label_store, g.sampling_index = load_project_labels(api, g.project_id, g.meta, g.app.cache_dir)
 
     progress = sly.Progress("App is ready", 1)
     progress.iter_done_report()
@@ -42,48 +39,77 @@ def deselect_all_classes(api: sly.Api, task_id, context, state, app_logger):
     api.task.set_field(task_id, "state.classes", [False] * len(g.meta.obj_classes))
 
 
+class StageTimer:
+    """Wall time of consecutive stages in milliseconds"""
+
+    def __init__(self):
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = round(1000 * (now - self._last), 1)
+        self._last = now
+
+
 @g.app.callback("preview")
 @sly.timeit
 def preview(api: sly.Api, task_id, context, state, app_logger):
+    timer = StageTimer()
     bg_images = update_bg_images(api, state)
-    if state["backgroundLabels"] == "smartMerge":
-        g.bg_meta = sly.ProjectMeta.from_json(api.project.get_meta(state["bgProjectId"]))
 
-    if len(bg_images) == 0:
+    if bg_images.wait_for_first() == 0:
         sly.logger.warning("There are no background images")
     else:
+        timer.lap("backgrounds")
         cache_dir = os.path.join(g.app.data_dir, "cache_images_preview")
         sly.fs.mkdir(cache_dir)
-        sly.fs.clean_dir(cache_dir)
+        g.sprite_bank.set_sources(api, g.images_info, g.label_store, g.image_cache)
+        g.backgrounds.set_images(bg_images)
+        timer.lap("foregrounds")
         img, ann, res_meta = synthesize(
-            api, task_id, state, g.meta, g.images_info, g.labels, bg_images, cache_dir
+            api, task_id, state, compile_plan(state["augs"]), g.meta, g.sprite_bank, g.sampling_index, g.backgrounds,
+            cache_dir, progress_reporter=g.progress_reporter, max_side=state["previewMaxSide"]
         )
+        timer.lap("synthesize")
         res_meta, ann = postprocess(state, ann, res_meta, sly.ProjectMeta())
         if state["taskType"] == "inst-seg" and state["highlightInstances"] is True:
             res_meta, ann = highlight_instances(res_meta, ann)
-        src_img_path = os.path.join(cache_dir, "res.png")
-        dst_img_path = os.path.join(f"/flying_object/{task_id}", "res.png")
-        sly.image.write(src_img_path, img)
-
-        if api.file.exists(g.team_id, dst_img_path):
-            api.file.remove(g.team_id, dst_img_path)
-        file_info = api.file.upload(g.team_id, src_img_path, dst_img_path)
+        timer.lap("postprocess")
+
+        # small previews are sent to gallery inline, without team files round trip
+        buffer = encode_image(img, "jpeg", quality=90)
+        ext = output_formats["jpeg"]
+        timer.lap("encode")
+        if buffer.size <= g.preview_inline_bytes:
+            url = "data:image/jpeg;base64," + base64.b64encode(buffer).decode("ascii")
+        else:
+            src_img_path = os.path.join(cache_dir, f"res{ext}")
+            dst_img_path = os.path.join(f"/flying_object/{task_id}", f"res{ext}")
+            buffer.tofile(src_img_path)
+            if api.file.exists(g.team_id, dst_img_path):
+                api.file.remove(g.team_id, dst_img_path)
+            url = api.file.upload(g.team_id, src_img_path, dst_img_path).storage_path
+            timer.lap("upload")
 
         gallery = dict(g.empty_gallery)
         gallery["content"]["projectMeta"] = res_meta.to_json()
         gallery["content"]["annotations"] = {
             "preview": {
-                "url": file_info.storage_path,
+                "url": url,
                 "figures": [label.to_json() for label in ann.labels],
             }
         }
         gallery["content"]["layout"] = [["preview"]]
 
+    g.progress_reporter.flush()
     fields = [
         {"field": "data.gallery", "payload": gallery},
         {"field": "state.previewLoading", "payload": False},
     ]
     api.task.set_fields(task_id, fields)
+    timer.lap("show")
+    sly.logger.info("Preview timings, ms", extra=timer.timings)
 
 
 @g.app.callback("generate")
@@ -91,12 +117,11 @@ def preview(api: sly.Api, task_id, context, state, app_logger):
 def generate(api: sly.Api, task_id, context, state, app_logger):
     bg_images = update_bg_images(api, state)
 
-    if len(bg_images) == 0:
+    if bg_images.wait_for_first() == 0:
         sly.logger.warning("There are no background images")
     else:
         cache_dir = os.path.join(g.app.data_dir, "cache_images_generate")
         sly.fs.mkdir(cache_dir)
-        sly.fs.clean_dir(cache_dir)
 
         if state["destProject"] == "newProject":
             res_project_name = state["resProjectName"]
@@ -110,34 +135,30 @@ def generate(api: sly.Api, task_id, context, state, app_logger):
 
         res_dataset = api.dataset.get_or_create(res_project.id, state["resDatasetName"])
         res_meta = sly.ProjectMeta.from_json(api.project.get_meta(res_project.id))
-        if state["backgroundLabels"] == "smartMerge":
-            g.bg_meta = sly.ProjectMeta.from_json(api.project.get_meta(state["bgProjectId"]))
+
+        merged_meta, classes_mapping = get_result_meta(state, g.meta, res_meta)
+        if res_meta != merged_meta:
+            api.project.update_meta(res_project.id, merged_meta.to_json())
 
         progress = sly.Progress("Generating images", state["imagesCount"])
-        refresh_progress_images(api, task_id, progress)
-        for i in range(state["imagesCount"]):
-            img, ann, cur_meta = synthesize(
-                api,
-                task_id,
-                state,
-                g.meta,
-                g.images_info,
-                g.labels,
-                bg_images,
-                cache_dir,
-                preview=False,
-            )
-            merged_meta, new_ann = postprocess(state, ann, cur_meta, res_meta)
-            if res_meta != merged_meta:
-                api.project.update_meta(res_project.id, merged_meta.to_json())
-                res_meta = merged_meta
-            image_info = api.image.upload_np(
-                res_dataset.id, f"{i + res_dataset.items_count}.png", img
-            )
-            api.annotation.upload_ann(image_info.id, new_ann)
-            progress.iter_done_report()
-            if progress.need_report():
-                refresh_progress_images(api, task_id, progress)
+        g.progress_reporter.report("images", progress)
+
+        def _images_uploaded(count):
+            progress.iters_done_report(count)
+            g.progress_reporter.report("images", progress)
+
+        g.sprite_bank.set_sources(api, g.images_info, g.label_store, g.image_cache)
+        images = synthesize_images(api, task_id, state, bg_images, cache_dir, state["imagesCount"])
+        encoder = Encoder.from_state(state)
+        with Uploader(api, res_dataset.id, encoder, cache_dir, progress_cb=_images_uploaded) as uploader:
+            for i, (img, ann, cur_meta) in enumerate(images):
+                _, new_ann = transform(state, ann, cur_meta)
+                new_ann = apply_classes_mapping(new_ann, classes_mapping)
+                uploader.put(f"{i + res_dataset.items_count}", img, new_ann)
+        encoder.close()
+        g.progress_reporter.flush()
+        sly.logger.info("Image cache usage", extra=g.image_cache.stats)
+        sly.logger.info("Output encoding", extra=encoder.stats)
 
     res_project = api.project.get_info_by_id(res_project.id)
     fields = [
@@ -158,6 +179,8 @@ def main():
     state = {}
 
     init_input_project(g.app.public_api, data, g.project_info)
+    g.progress_reporter = ProgressReporter(g.app.public_api, g.app.task_id)
+    g.sprite_bank, g.image_cache, g.backgrounds = init_caches(g.app.public_api, g.app.data_dir, g.app.cache_dir)
 
     # background tab
     state["tabName"] = "Backgrounds"
@@ -187,6 +210,11 @@ def main():
     state["destProjectId"] = None
     state["resProjectName"] = f"synthetic_{g.project_info.name}"
     state["imagesCount"] = 10
+    state["previewMaxSide"] = 1024
+    state["workersCount"] = os.cpu_count() or 1
+    state["outputFormat"] = "png"
+    state["outputQuality"] = 95
+    state["pngCompression"] = 3
 
     # @TODO: ONLY for debug
     # state["bgProjectId"] = project_id
@@ -207,6 +235,5 @@ def main():
 # @TODO: keep foreground w%/h% on background image
 # @TODO: handle invalid augementations from user (validate augmentations)
 # @TODO: check sum of objects for selected classes - disable buttons
-# @TODO: output resolution
 if __name__ == "__main__":
     sly.main_wrapper("main", main)
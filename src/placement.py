@@ -0,0 +1,73 @@
+import random
+import cv2
+import numpy as np
+
+import aug
+from visibility import VisibilityTracker
+
+
+class PlacementSampler:
+    """Samples origins of objects so that all placed objects stay visible enough.
+
+    The first attempt for an object is uniform. After a rejection origins are drawn only
+    from the ones that are guaranteed to satisfy the visibility threshold: every pixel of
+    placed object v is weighted by 1 / slack_v, where slack_v is how many pixels v can still
+    lose, so an origin whose bbox sum of weights is <= 1 can not hide too much of any object.
+    Sums for all origins are computed at once from the integral image of the weights.
+    """
+
+    def __init__(self, visibility: VisibilityTracker, threshold, attempts=3):
+        self.visibility = visibility
+        self.threshold = threshold
+        self.attempts = attempts
+        self.stats = {"objects": 0, "placed": 0, "skipped": 0, "attempts": 0, "safe_attempts": 0}
+        self._integral = None  # integral image of weights, reset when cover map changes
+
+    def find(self, mask: np.ndarray):
+        """Returns (origin, covered) for the object mask or None if it can not be placed"""
+        self.stats["objects"] += 1
+        safe_origins, grid_shape = None, None
+        for attempt in range(self.attempts):
+            self.stats["attempts"] += 1
+            origin = None
+            if attempt > 0:
+                if safe_origins is None:
+                    safe_origins, grid_shape = self._get_safe_origins(mask.shape)
+                if len(safe_origins) > 0:
+                    self.stats["safe_attempts"] += 1
+                    y, x = np.unravel_index(safe_origins[random.randrange(len(safe_origins))], grid_shape)
+                    origin = (int(x), int(y))
+            if origin is None:
+                origin = aug.find_origin(self.visibility.cover.shape, mask.shape)
+
+            covered = self.visibility.count_covered(mask, origin[0], origin[1])
+            if self.visibility.is_visible(covered, self.threshold):
+                return origin, covered
+
+        self.stats["skipped"] += 1
+        return None
+
+    def place(self, mask: np.ndarray, x, y, idx, covered: np.ndarray):
+        self.visibility.place(mask, x, y, idx, covered)
+        self._integral = None
+        self.stats["placed"] += 1
+
+    def acceptance_rate(self):
+        if self.stats["attempts"] == 0:
+            return 1.0
+        return self.stats["placed"] / self.stats["attempts"]
+
+    def _get_safe_origins(self, mask_shape):
+        cover = self.visibility.cover
+        if self._integral is None:
+            slack = self.visibility.current - self.threshold * self.visibility.original
+            weights_lut = 1.0 / np.maximum(slack, 0.5)
+            weights_lut[0] = 0
+            self._integral = cv2.integral(weights_lut[cover], sdepth=cv2.CV_64F)
+
+        h, w = mask_shape[:2]
+        ih, iw = cover.shape
+        s = self._integral
+        sums = s[h:ih + 1, w:iw + 1] - s[0:ih - h + 1, w:iw + 1] - s[h:ih + 1, 0:iw - w + 1] + s[0:ih - h + 1, 0:iw - w + 1]
+        return np.flatnonzero(sums <= 1 + 1e-6), sums.shape
+
@@ -6,6 +6,12 @@ from supervisely._utils import generate_free_name
 
 def postprocess(state, ann: sly.Annotation, cur_meta: sly.ProjectMeta, res_meta: sly.ProjectMeta) \
         -> Tuple[sly.ProjectMeta, sly.Annotation]:
+    new_meta, new_ann = transform(state, ann, cur_meta)
+    new_meta, res_meta, new_ann = merge_classes(new_meta, res_meta, new_ann)
+    return res_meta, new_ann
+
+
+def transform(state, ann: sly.Annotation, cur_meta: sly.ProjectMeta) -> Tuple[sly.ProjectMeta, sly.Annotation]:
     task_type = state["taskType"]
     if task_type == "seg":
         new_meta, new_ann = transform_for_segmentation(cur_meta, ann)
@@ -13,9 +19,24 @@ def postprocess(state, ann: sly.Annotation, cur_meta: sly.ProjectMeta, res_meta:
         new_meta, new_ann = transform_for_detection(cur_meta, ann)
     elif task_type == "inst-seg":
         new_meta, new_ann = transform_for_instance_segmentation(cur_meta, ann)
+    return new_meta, new_ann
 
-    new_meta, res_meta, new_ann = merge_classes(new_meta, res_meta, new_ann)
-    return res_meta, new_ann
+
+def get_result_meta(state, meta: sly.ProjectMeta, res_meta: sly.ProjectMeta) -> Tuple[sly.ProjectMeta, dict]:
+    """Resolves destination meta once for all selected classes.
+
+    Returns merged meta and mapping from postprocessed class names to destination classes,
+    see apply_classes_mapping.
+    """
+    classes = [meta.get_obj_class(name).clone(geometry_type=sly.Bitmap) for name in state["selectedClasses"]]
+    new_classes = []
+    for obj_class in classes:
+        if state["taskType"] == "det":
+            new_classes.append(obj_class.clone(name=obj_class.name + "-bbox", geometry_type=sly.Rectangle))
+        else:
+            new_classes.append(obj_class.clone(name=obj_class.name + "-mask"))
+    new_meta = sly.ProjectMeta(obj_classes=sly.ObjClassCollection(new_classes))
+    return map_classes(new_meta, res_meta)
 
 
 def transform_for_detection(meta: sly.ProjectMeta, ann: sly.Annotation) -> Tuple[sly.ProjectMeta, sly.Annotation]:
@@ -39,22 +60,42 @@ def transform_for_detection(meta: sly.ProjectMeta, ann: sly.Annotation) -> Tuple
 
 def transform_for_segmentation(meta: sly.ProjectMeta, ann: sly.Annotation) -> Tuple[sly.ProjectMeta, sly.Annotation]:
     new_classes = {}
-    class_masks = {}
-    for obj_class in meta.obj_classes:
+    class_indices = {}
+    for class_idx, obj_class in enumerate(meta.obj_classes, start=1):
         obj_class: sly.ObjClass
         new_class = obj_class.clone(name=obj_class.name + "-mask")
         new_classes[obj_class.name] = new_class
-        class_masks[obj_class.name] = np.zeros(ann.img_size, np.uint8)
+        class_indices[obj_class.name] = class_idx
 
+    # single map of class indices for all labels, labels are already non-overlapping after synthesis
     new_class_collection = sly.ObjClassCollection(list(new_classes.values()))
+    class_map = np.zeros(ann.img_size, np.uint8 if len(class_indices) < 256 else np.int32)
+    class_bboxes = {}
     for label in ann.labels:
-        label.draw(class_masks[label.obj_class.name], color=255)
-
+        label.draw(class_map, color=class_indices[label.obj_class.name])
+        bbox = label.geometry.to_bbox()
+        if label.obj_class.name in class_bboxes:
+            top, left, bottom, right = class_bboxes[label.obj_class.name]
+            bbox = sly.Rectangle(
+                min(top, bbox.top), min(left, bbox.left), max(bottom, bbox.bottom), max(right, bbox.right)
+            )
+        class_bboxes[label.obj_class.name] = (bbox.top, bbox.left, bbox.bottom, bbox.right)
+
+    img_h, img_w = class_map.shape
     new_labels = []
-    for class_name, white_mask in class_masks.items():
-        mask = white_mask == 255
+    for class_name, class_idx in class_indices.items():
+        if class_name not in class_bboxes:
+            continue
+        top, left, bottom, right = class_bboxes[class_name]
+        top, left = max(top, 0), max(left, 0)
+        bottom, right = min(bottom, img_h - 1), min(right, img_w - 1)
+        if top > bottom or left > right:
+            continue
+        mask = class_map[top:bottom + 1, left:right + 1] == class_idx
+        if not np.any(mask):
+            continue
         obj_class = new_classes[class_name]
-        bitmap = sly.Bitmap(data=mask)
+        bitmap = sly.Bitmap(data=mask, origin=sly.PointLocation(row=top, col=left))
         new_labels.append(sly.Label(geometry=bitmap, obj_class=obj_class))
 
     res_meta = meta.clone(obj_classes=new_class_collection)
@@ -96,6 +137,12 @@ def highlight_instances(meta: sly.ProjectMeta, ann: sly.Annotation) -> Tuple[sly
 
 
 def merge_classes(cur_meta: sly.ProjectMeta, res_meta: sly.ProjectMeta, ann: sly.Annotation):
+    res_meta, mapping = map_classes(cur_meta, res_meta)
+    new_ann = apply_classes_mapping(ann, mapping)
+    return (res_meta, res_meta, new_ann)
+
+
+def map_classes(cur_meta: sly.ProjectMeta, res_meta: sly.ProjectMeta) -> Tuple[sly.ProjectMeta, dict]:
     existing_names = set([obj_class.name for obj_class in res_meta.obj_classes])
     mapping = {}
     for obj_class in cur_meta.obj_classes:
@@ -111,13 +158,14 @@ def merge_classes(cur_meta: sly.ProjectMeta, res_meta: sly.ProjectMeta, ann: sly
             dest_class = obj_class.clone(name=new_name)
             res_meta = res_meta.add_obj_class(dest_class)
         mapping[obj_class.name] = dest_class
+    return res_meta, mapping
+
 
+def apply_classes_mapping(ann: sly.Annotation, mapping: dict) -> sly.Annotation:
     new_labels = []
     for label in ann.labels:
         if label.obj_class.name not in mapping:
             new_labels.append(label)
         else:
             new_labels.append(label.clone(obj_class=mapping[label.obj_class.name]))
-
-    new_ann = ann.clone(labels=new_labels)
-    return (res_meta, res_meta, new_ann)
+    return ann.clone(labels=new_labels)
@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+import multiprocessing
+import supervisely as sly
+
+# progress bar -> (percent, current, total) fields in UI
+progress_fields = {
+    "preview": ("data.progressPercentPreview", "data.progressCurrentPreview", "data.progressTotalPreview"),
+    "objects": ("data.progressPercent", "data.progressCurrent", "data.progressTotal"),
+    "images": ("data.progressPercentImages", "data.progressCurrentImage", "data.progressTotalImages"),
+}
+
+
+class ProgressReporter:
+    """Shows progress bars in UI without blocking the caller.
+
+    update only remembers the latest value of a bar, a background thread sends all changed
+    bars in one set_fields call at most once per interval. Forked workers use the same
+    object, every worker puts a bar to a process queue at most once per interval (and when
+    it is complete), the bar shown is the sum of the latest values of all workers.
+    """
+
+    def __init__(self, api: sly.Api, task_id, interval=0.5):
+        self._api = api
+        self._task_id = task_id
+        self._interval = interval
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()  # keeps calls in order of values
+        self._changed = {}  # bar -> (current, total), not sent yet
+        self._workers = {}  # bar -> {worker pid -> (current, total)}
+        self._last_put = {}  # bar -> time of the last put to queue, in a worker
+        self._queue = multiprocessing.get_context("fork").SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._reader = threading.Thread(target=self._read_workers, daemon=True)
+        self._reader.start()
+
+    def update(self, bar, current, total):
+        if bar not in progress_fields:
+            raise ValueError(f"Unknown progress bar {bar!r}, supported: {list(progress_fields)}")
+        if os.getpid() != self._pid:
+            now = time.monotonic()
+            if current < total and now - self._last_put.get(bar, 0) < self._interval:
+                return
+            self._last_put[bar] = now
+            self._queue.put((os.getpid(), bar, current, total))
+            return
+        with self._lock:
+            self._changed[bar] = (current, total)
+
+    def report(self, bar, progress: sly.Progress):
+        self.update(bar, progress.current, progress.total)
+
+    def clear_workers(self):
+        """Forgets values of workers, e.g. before a new pool is started"""
+        with self._lock:
+            self._workers = {}
+
+    def flush(self):
+        """Sends pending updates right away, e.g. before showing results"""
+        with self._send_lock:
+            with self._lock:
+                changed, self._changed = self._changed, {}
+            if len(changed) > 0:
+                self._send(changed)
+
+    def _send(self, changed):
+        fields = []
+        for bar, (current, total) in changed.items():
+            percent_field, current_field, total_field = progress_fields[bar]
+            fields.extend([
+                {"field": percent_field, "payload": int(current * 100 / total) if total > 0 else 0},
+                {"field": current_field, "payload": current},
+                {"field": total_field, "payload": total},
+            ])
+        try:
+            self._api.task.set_fields(self._task_id, fields)
+        except Exception as e:
+            sly.logger.warning("Failed to show progress", extra={"error": repr(e)})
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            self.flush()
+
+    def _read_workers(self):
+        while True:
+            pid, bar, current, total = self._queue.get()
+            with self._lock:
+                values = self._workers.setdefault(bar, {})
+                values[pid] = (current, total)
+                self._changed[bar] = (sum(value[0] for value in values.values()),
+                                      sum(value[1] for value in values.values()))
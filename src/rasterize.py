@@ -1,8 +1,10 @@
-import numpy as np
 from typing import Tuple
 
 import supervisely as sly
 
+import rle
+from rle import RLEMask
+
 
 def need_convert(geometry_type) -> bool:
     if geometry_type in [sly.Polygon, sly.Rectangle, sly.Bitmap, sly.AnyGeometry]:
@@ -16,38 +18,48 @@ def allow_render_for_any_shape(lbl: sly.Label):
     return True
 
 
-def convert_to_nonoverlapping(meta: sly.ProjectMeta, ann: sly.Annotation) -> Tuple[sly.ProjectMeta, sly.Annotation]:
-    common_img = np.zeros(ann.img_size, np.int32)  # size is (h, w)
-    for idx, lbl in enumerate(ann.labels, start=1):
-        if need_convert(lbl.obj_class.geometry_type):
-            if allow_render_for_any_shape(lbl) is True:
-                lbl.draw(common_img, color=idx)
-            else:
-                sly.logger.warning(
-                    "Object of class {!r} (shape: {!r}) has non spatial shape {!r}. It will not be rendered."
-                        .format(lbl.obj_class.name,
-                                lbl.obj_class.geometry_type.geometry_name(),
-                                lbl.geometry.geometry_name()))
+def label_to_rle(lbl: sly.Label, img_size) -> RLEMask:
+    if isinstance(lbl.geometry, sly.Bitmap):
+        return RLEMask.from_bitmap(lbl.geometry, img_size)
+    bitmap_class = lbl.obj_class.clone(geometry_type=sly.Bitmap)
+    masks = [RLEMask.from_bitmap(converted.geometry, img_size) for converted in lbl.convert(bitmap_class)]
+    return rle.union_all(masks, img_size)
+
+
+def get_visible_masks(labels, img_size, above: RLEMask = None):
+    """Visible RLE masks of labels, every label is drawn over the previous ones and under above area.
+    None for labels that can not be rendered"""
+    covered = above if above is not None else RLEMask([], [], img_size)
+    masks = [None] * len(labels)
+    for idx in reversed(range(len(labels))):
+        lbl = labels[idx]
+        if not need_convert(lbl.obj_class.geometry_type):
+            continue
+        if allow_render_for_any_shape(lbl) is False:
+            sly.logger.warning(
+                "Object of class {!r} (shape: {!r}) has non spatial shape {!r}. It will not be rendered."
+                    .format(lbl.obj_class.name,
+                            lbl.obj_class.geometry_type.geometry_name(),
+                            lbl.geometry.geometry_name()))
+            continue
+        mask = label_to_rle(lbl, img_size)
+        masks[idx] = mask.subtract(covered)
+        covered = covered.union(mask)
+    return masks
+
 
+def masks_to_annotation(meta: sly.ProjectMeta, img_size, objects) -> Tuple[sly.ProjectMeta, sly.Annotation]:
+    """objects - (obj_class, visible RLEMask or None, tags or None) from bottom to top.
+    Dense bitmaps are created only here, for the result annotation. Meta keeps only present classes"""
     new_classes = sly.ObjClassCollection()
     new_labels = []
-    for idx, lbl in enumerate(ann.labels, start=1):
-        if not need_convert(lbl.obj_class.geometry_type):
-            new_labels.append(lbl.clone())
-        else:
-            if allow_render_for_any_shape(lbl) is False:
-                continue
-            # @TODO: get part of the common_img for speedup
-            mask = common_img == idx
-            if np.any(mask):  # figure may be entirely covered by others
-                g = lbl.geometry
-                new_bmp = sly.Bitmap(data=mask)
-                if new_classes.get(lbl.obj_class.name) is None:
-                    new_classes = new_classes.add(lbl.obj_class.clone(geometry_type=sly.Bitmap))
-
-                new_lbl = lbl.clone(geometry=new_bmp, obj_class=new_classes.get(lbl.obj_class.name))
-                new_labels.append(new_lbl)
+    for obj_class, mask, tags in objects:
+        if mask is None or mask.is_empty():
+            continue  # figure is out of image, non spatial or entirely covered by others
+        if new_classes.get(obj_class.name) is None:
+            new_classes = new_classes.add(obj_class.clone(geometry_type=sly.Bitmap))
+        new_labels.append(sly.Label(mask.to_bitmap(), new_classes.get(obj_class.name), tags))
 
     new_meta = meta.clone(obj_classes=new_classes)
-    new_ann = ann.clone(labels=new_labels)
+    new_ann = sly.Annotation(img_size=img_size, labels=new_labels)
     return (new_meta, new_ann)
@@ -0,0 +1,115 @@
+import numpy as np
+import supervisely as sly
+
+
+def encode(mask: np.ndarray) -> np.ndarray:
+    """Run lengths of row-major flattened boolean mask, runs alternate and start with False"""
+    flat = mask.ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [len(flat)]])
+    runs = np.diff(bounds)
+    if len(flat) > 0 and flat[0]:
+        runs = np.concatenate([[0], runs])
+    return runs.astype(np.int32)
+
+
+def decode(runs: np.ndarray, shape) -> np.ndarray:
+    values = np.arange(len(runs)) % 2 == 1
+    return np.repeat(values, runs).reshape(shape)
+
+
+class RLEMask:
+    """Binary mask of an image as sorted non-overlapping runs [start, end) of row-major pixel indices.
+
+    Set operations work on runs only, dense mask is made again only by to_bitmap.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, img_size):
+        self.starts = np.asarray(starts, np.int64)
+        self.ends = np.asarray(ends, np.int64)
+        self.img_size = tuple(img_size)
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray, top, left, img_size):
+        """Mask placed at (top, left), it must be inside of the image"""
+        h, w = mask.shape
+        padded = np.zeros((h, w + 2), np.int8)
+        padded[:, 1:-1] = mask
+        changes = np.diff(padded, axis=1)
+        start_rows, start_cols = np.nonzero(changes == 1)
+        end_rows, end_cols = np.nonzero(changes == -1)
+        img_w = img_size[1]
+        starts = (start_rows + top) * img_w + left + start_cols
+        ends = (end_rows + top) * img_w + left + end_cols
+        return cls(starts, ends, img_size)
+
+    @classmethod
+    def from_bitmap(cls, bitmap, img_size):
+        """Bitmap geometry clipped to the image"""
+        top, left = bitmap.origin.row, bitmap.origin.col
+        data = bitmap.data[max(-top, 0):, max(-left, 0):]
+        top, left = max(top, 0), max(left, 0)
+        data = data[:max(img_size[0] - top, 0), :max(img_size[1] - left, 0)]
+        return cls.from_mask(data, top, left, img_size)
+
+    @property
+    def area(self) -> int:
+        return int(np.sum(self.ends - self.starts))
+
+    def is_empty(self) -> bool:
+        return len(self.starts) == 0
+
+    def intersect(self, other: "RLEMask") -> "RLEMask":
+        return self._combine(other, np.logical_and)
+
+    def subtract(self, other: "RLEMask") -> "RLEMask":
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def union(self, other: "RLEMask") -> "RLEMask":
+        return self._combine(other, np.logical_or)
+
+    def to_bitmap(self):
+        """sly.Bitmap cropped to the mask bbox, None for empty mask"""
+        if self.is_empty():
+            return None
+        img_w = self.img_size[1]
+        first_row, last_row = self.starts[0] // img_w, (self.ends[-1] - 1) // img_w
+        band = np.zeros((last_row - first_row + 1) * img_w + 1, np.int8)
+        shift = first_row * img_w
+        np.add.at(band, self.starts - shift, 1)
+        np.add.at(band, self.ends - shift, -1)
+        band = np.cumsum(band[:-1]).astype(bool).reshape(-1, img_w)
+        cols = np.flatnonzero(np.any(band, axis=0))
+        data = band[:, cols[0]:cols[-1] + 1]
+        return sly.Bitmap(data, origin=sly.PointLocation(row=int(first_row), col=int(cols[0])))
+
+    def _combine(self, other: "RLEMask", op) -> "RLEMask":
+        bounds = np.union1d(np.concatenate([self.starts, self.ends]), np.concatenate([other.starts, other.ends]))
+        if len(bounds) < 2:
+            return RLEMask([], [], self.img_size)
+        keep = op(self._contains(bounds[:-1]), other._contains(bounds[:-1]))
+        # elementary segments [bounds[i], bounds[i + 1]) are merged into runs where keep changes
+        edges = np.diff(np.concatenate([[False], keep, [False]]).astype(np.int8))
+        return RLEMask(bounds[np.flatnonzero(edges == 1)], bounds[np.flatnonzero(edges == -1)], self.img_size)
+
+    def _contains(self, points: np.ndarray) -> np.ndarray:
+        if len(self.starts) == 0:
+            return np.zeros(len(points), bool)
+        run = np.searchsorted(self.starts, points, side="right") - 1
+        return (run >= 0) & (points < self.ends[np.maximum(run, 0)])
+
+
+def union_all(masks, img_size) -> RLEMask:
+    """Union of any number of masks in one sort"""
+    masks = list(masks)
+    starts = np.concatenate([mask.starts for mask in masks] + [np.zeros(0, np.int64)])
+    ends = np.concatenate([mask.ends for mask in masks] + [np.zeros(0, np.int64)])
+    if len(starts) == 0:
+        return RLEMask(starts, ends, img_size)
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    # a new run begins where start is beyond everything before it
+    first = np.flatnonzero(np.concatenate([[True], starts[1:] > reach[:-1]]))
+    last = np.concatenate([first[1:] - 1, [len(starts) - 1]])
+    return RLEMask(starts[first], reach[last], img_size)
@@ -0,0 +1,99 @@
+import numpy as np
+
+from label_store import LabelStore
+
+weights_modes = ["label", "image", "inverse-frequency"]
+
+
+class ClassSamplingIndex:
+    """Flat array-backed index of labels of one class for constant time weighted sampling.
+
+    Weights modes:
+        label - every label has the same probability
+        image - every source image has the same probability, then label of the image
+        inverse-frequency - labels of rare sizes (log2 of area) are picked more often
+    """
+
+    def __init__(self, positions, image_ids, bboxes, areas):
+        self.positions = np.asarray(positions, np.int64)  # positions of labels in LabelStore
+        self.image_ids = np.asarray(image_ids, np.int64)
+        self.bboxes = np.asarray(bboxes, np.int32).reshape(-1, 4)  # top, left, bottom, right
+        self.areas = np.asarray(areas, np.float64)
+        self._alias_tables = {}  # weights mode -> (prob, alias)
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def sample(self, count, mode="label") -> np.ndarray:
+        """Positions of count labels in the index drawn with the alias method"""
+        prob, alias = self._get_alias_table(mode)
+        picks = np.random.randint(0, len(self), size=count)
+        keep = np.random.random(count) < prob[picks]
+        return np.where(keep, picks, alias[picks])
+
+    def get_weights(self, mode) -> np.ndarray:
+        if mode == "label":
+            return np.ones(len(self))
+        if mode == "image":
+            _, inverse, counts = np.unique(self.image_ids, return_inverse=True, return_counts=True)
+            return 1.0 / counts[inverse]
+        if mode == "inverse-frequency":
+            bins = np.floor(np.log2(np.maximum(self.areas, 1))).astype(np.int64)
+            _, inverse, counts = np.unique(bins, return_inverse=True, return_counts=True)
+            return 1.0 / counts[inverse]
+        raise ValueError(f"Unknown sampling mode {mode!r}, supported: {weights_modes}")
+
+    def _get_alias_table(self, mode):
+        if mode not in self._alias_tables:
+            self._alias_tables[mode] = build_alias_table(self.get_weights(mode))
+        return self._alias_tables[mode]
+
+
+def build_alias_table(weights: np.ndarray):
+    """Vose's alias method tables"""
+    n = len(weights)
+    scaled = weights * n / weights.sum()
+    prob = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1 - scaled[s]
+        if scaled[l] < 1:
+            small.append(l)
+        else:
+            large.append(l)
+    return prob, alias
+
+
+def build_sampling_index(label_store: LabelStore) -> dict:
+    """class name -> ClassSamplingIndex"""
+    index = {}
+    for class_name in label_store.class_names:
+        positions = label_store.positions_of_class(class_name)
+        if len(positions) > 0:
+            index[class_name] = ClassSamplingIndex(
+                positions, label_store.image_ids[positions], label_store.bboxes[positions], label_store.areas[positions]
+            )
+    return index
+
+
+def sample_labels(index: dict, classes, mode="label"):
+    """Draws source labels for a sequence of class names at once.
+
+    Returns list of label positions in LabelStore, None for classes without labels.
+    """
+    classes = np.asarray(classes)
+    picks = [None] * len(classes)
+    for class_name in np.unique(classes):
+        if class_name not in index:
+            continue
+        class_index: ClassSamplingIndex = index[class_name]
+        positions = np.flatnonzero(classes == class_name)
+        drawn = class_index.sample(len(positions), mode)
+        for position, label_position in zip(positions, drawn):
+            picks[position] = int(class_index.positions[label_position])
+    return picks
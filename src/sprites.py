@@ -0,0 +1,101 @@
+import os
+import threading
+import multiprocessing.util
+import numpy as np
+import supervisely as sly
+
+from generate import get_label_foreground
+from image_cache import ImageCache
+from label_store import LabelStore
+
+
+class SpriteBank:
+    """Foregrounds of labels cropped on first use and stored in memory mapped files on disk.
+
+    Every sprite is a RGB crop with a single channel mask. When a label is requested for the
+    first time its source image is read once and all labels of that image are cropped.
+    Sprites are appended to "images_<pid>.bin" (3 bytes per pixel) and "masks_<pid>.bin"
+    (1 byte per pixel) of the current process, so forked workers crop into their own files
+    and still read the sprites cropped by the parent before fork. Files of a forked process
+    are removed when it exits, its sprites are not seen by other processes.
+    """
+
+    def __init__(self, bank_dir):
+        self.bank_dir = bank_dir
+        sly.fs.mkdir(bank_dir)
+        sly.fs.clean_dir(bank_dir)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._index = {}  # label position in LabelStore -> (pid of files, offset, h, w)
+        self._sizes = {}  # pid -> pixels written to files of this process
+        self._maps = {}  # pid -> (images, masks) memory maps
+        self._api: sly.Api = None
+        self._image_infos = None
+        self._label_store: LabelStore = None
+        self._image_cache: ImageCache = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def set_sources(self, api: sly.Api, image_infos, label_store: LabelStore, image_cache: ImageCache):
+        """Where sprites are cropped from, sprites of a previous label store are dropped"""
+        with self._lock:
+            if label_store is not self._label_store:
+                self._index = {}
+            self._api = api
+            self._image_infos = image_infos
+            self._label_store = label_store
+            self._image_cache = image_cache
+
+    def get(self, position):
+        """Returns writable copies of sprite image (h, w, 3) and mask (h, w)"""
+        with self._lock:
+            if position not in self._index:
+                self._crop_image(int(self._label_store.image_ids[position]))
+            pid, offset, h, w = self._index[position]
+            images, masks = self._get_maps(pid, offset + h * w)
+        img = images[offset * 3:(offset + h * w) * 3].reshape(h, w, 3)
+        mask = masks[offset:offset + h * w].reshape(h, w)
+        return np.array(img), np.array(mask)
+
+    def _paths(self, pid):
+        return os.path.join(self.bank_dir, f"images_{pid}.bin"), os.path.join(self.bank_dir, f"masks_{pid}.bin")
+
+    def _crop_image(self, image_id):
+        source_image = self._image_cache.read(self._api, self._image_infos[image_id])
+        positions = np.flatnonzero(self._label_store.image_ids == image_id)
+        pid = os.getpid()
+        size = self._sizes.get(pid)
+        # files of a new process are truncated, pid can be left from a previous worker
+        mode = "ab" if size is not None else "wb"
+        size = size or 0
+        images_path, masks_path = self._paths(pid)
+        if mode == "wb" and pid != self._pid:
+            multiprocessing.util.Finalize(None, _remove_files, args=(images_path, masks_path), exitpriority=0)
+        with open(images_path, mode) as images_file, open(masks_path, mode) as masks_file:
+            for position in positions:
+                position = int(position)
+                if position in self._index:
+                    continue
+                img, mask = get_label_foreground(source_image, self._label_store.get_label(position))
+                h, w = mask.shape[:2]
+                images_file.write(np.ascontiguousarray(img).tobytes())
+                masks_file.write(np.ascontiguousarray(mask).tobytes())
+                self._index[position] = (pid, size, h, w)
+                size += h * w
+        self._sizes[pid] = size
+        sly.logger.debug(f"Sprite bank: {len(self._index)} sprites, {size * 4 / 1024 ** 2:.1f} MB in process {pid}")
+
+    def _get_maps(self, pid, pixels):
+        """Memory maps of sprite files of process pid covering at least pixels"""
+        maps = self._maps.get(pid)
+        if maps is None or len(maps[1]) < pixels:
+            images_path, masks_path = self._paths(pid)
+            maps = (np.memmap(images_path, dtype=np.uint8, mode="r"), np.memmap(masks_path, dtype=np.uint8, mode="r"))
+            self._maps[pid] = maps
+        return maps
+
+
+def _remove_files(*paths):
+    for path in paths:
+        sly.fs.silent_remove(path)
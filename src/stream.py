@@ -0,0 +1,117 @@
+import os
+from collections import namedtuple
+import numpy as np
+import supervisely as sly
+
+import aug
+from backgrounds import BackgroundProvider
+from caches import backgrounds_cache_bytes, init_caches, load_project_labels
+from generate import synthesize, update_bg_images
+from postprocess import transform
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+output_kinds = ["annotation", "arrays"]
+
+SynthesisContext = namedtuple(
+    "SynthesisContext",
+    ["project_id", "meta", "images_info", "label_store", "sampling_index", "sprite_bank", "image_cache", "backgrounds",
+     "bg_images"],
+)
+
+
+def prepare(api: sly.Api, state, project_id, data_dir, cache_dir) -> SynthesisContext:
+    """Fills local caches of the foreground project for state outside of the app, e.g. in training script.
+
+    data_dir keeps the sprite bank of this run, cache_dir keeps downloaded images and annotations between runs.
+    """
+    meta = sly.ProjectMeta.from_json(api.project.get_meta(project_id))
+    sprite_bank, image_cache, backgrounds = init_caches(api, data_dir, cache_dir)
+    images_info, label_store, sampling_index = load_project_labels(api, project_id, meta, cache_dir)
+    sprite_bank.set_sources(api, images_info, label_store, image_cache)
+    bg_images = update_bg_images(api, state)
+    if bg_images.wait_for_first() == 0:
+        raise ValueError("There are no background images")
+    return SynthesisContext(
+        project_id, meta, images_info, label_store, sampling_index, sprite_bank, image_cache, backgrounds, bg_images
+    )
+
+
+def stream_samples(api: sly.Api, state, context: SynthesisContext, output="annotation",
+                   backgrounds: BackgroundProvider = None):
+    """Yields synthetic samples indefinitely, nothing is uploaded.
+
+    output:
+        annotation - (image, annotation, meta) transformed for state["taskType"]
+        arrays - (image, class_map, instance_map), class index is position in state["selectedClasses"] + 1,
+                 instance index is label index + 1, 0 is background in both maps
+    context is made by prepare.
+    """
+    if output not in output_kinds:
+        raise ValueError(f"Unknown output {output!r}, supported: {output_kinds}")
+    if backgrounds is None:
+        backgrounds = context.backgrounds
+    backgrounds.set_images(context.bg_images)
+    plan = aug.compile_plan(state["augs"])
+    class_indices = {name: idx for idx, name in enumerate(state["selectedClasses"], start=1)}
+    while True:
+        img, ann, meta = synthesize(
+            api, None, state, plan, context.meta, context.sprite_bank, context.sampling_index, backgrounds, None,
+            preview=False
+        )
+        if output == "annotation":
+            meta, ann = transform(state, ann, meta)
+            yield img, ann, meta
+            continue
+
+        class_map = np.zeros(ann.img_size, np.uint8 if len(class_indices) < 256 else np.int32)
+        instance_map = np.zeros(ann.img_size, np.int32)
+        for idx, label in enumerate(ann.labels, start=1):
+            label.draw(class_map, color=class_indices[label.obj_class.name])
+            label.draw(instance_map, color=idx)
+        yield img, class_map, instance_map
+
+
+class SyntheticDataset(IterableDataset):
+    """Endless PyTorch style dataset of synthetic samples generated in data loader workers.
+
+    Caches are prepared in the main process and inherited by forked workers, all backgrounds
+    are listed before workers start. Every worker gets its own api session, background
+    provider and random stream made of seed, epoch and worker id (random if seed is None).
+    With a fixed seed every epoch repeats the same samples unless set_epoch is called before
+    it, as with DistributedSampler.
+    """
+
+    def __init__(self, api: sly.Api, state, project_id, data_dir, cache_dir, output="arrays", seed=None):
+        self.state = state
+        self.output = output
+        self.seed = seed
+        self.epoch = 0
+        self._server_address = api.server_address
+        self._token = api.token
+        self.context = prepare(api, state, project_id, data_dir, cache_dir)
+        self.context.bg_images.wait()
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        seed = self.seed if self.seed is not None else int.from_bytes(os.urandom(4), "little")
+        aug.reseed(int(np.random.SeedSequence([seed, self.epoch, worker_id]).generate_state(1)[0]))
+
+        api = sly.Api(self._server_address, self._token)
+        # new provider, backgrounds prefetched by a previous iterator were drawn with another seed
+        backgrounds = BackgroundProvider(api, self.context.image_cache, max_bytes=backgrounds_cache_bytes // workers)
+        if worker_info is not None:
+            self.context.sprite_bank.set_sources(
+                api, self.context.images_info, self.context.label_store, self.context.image_cache
+            )
+        return stream_samples(api, self.state, self.context, self.output, backgrounds)
@@ -0,0 +1,82 @@
+import os
+import queue
+import threading
+from concurrent.futures import wait
+import supervisely as sly
+
+from encode import Encoder
+
+
+class Uploader:
+    """Uploads generated images with annotations in batches on a background thread.
+
+    Images are encoded by encoder into files_dir as soon as they are put, producer puts items
+    into a bounded queue, so synthesis blocks only when uploading falls behind.
+    """
+
+    def __init__(self, api: sly.Api, dataset_id, encoder: Encoder, files_dir, batch_size=50, queue_size=100,
+                 progress_cb=None):
+        self._api = api
+        self._dataset_id = dataset_id
+        self._encoder = encoder
+        self._files_dir = files_dir
+        self._batch_size = batch_size
+        self._progress_cb = progress_cb
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def put(self, name, img, ann: sly.Annotation):
+        """Name without extension, it is defined by encoder output format"""
+        if self._error is not None:
+            raise self._error
+        name = f"{name}{self._encoder.ext}"
+        path = os.path.join(self._files_dir, name)
+        self._queue.put((name, path, self._encoder.submit(img, path), ann))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        batch = []
+        while True:
+            item = self._queue.get()
+            if item is not None:
+                batch.append(item)
+            if len(batch) > 0 and (item is None or len(batch) >= self._batch_size or self._queue.empty()):
+                self._upload(batch)
+                batch = []
+            if item is None:
+                break
+
+    def _upload(self, batch):
+        names, paths, encoded, anns = zip(*batch)
+        try:
+            if self._error is not None:
+                # previous batch failed, drain the queue to unblock producer
+                return
+            for future in encoded:
+                future.result()
+            image_infos = self._api.image.upload_paths(self._dataset_id, names, paths)
+            self._api.annotation.upload_anns([info.id for info in image_infos], anns)
+            if self._progress_cb is not None:
+                self._progress_cb(len(batch))
+        except Exception as e:
+            sly.logger.error("Failed to upload images batch", extra={"error": repr(e)})
+            self._error = e
+        finally:
+            for future in encoded:
+                future.cancel()
+            wait(encoded)
+            for path in paths:
+                sly.fs.silent_remove(path)
@@ -0,0 +1,50 @@
+import numpy as np
+
+import rle
+from rle import RLEMask
+
+
+class VisibilityTracker:
+    """Cover map of placed objects with their original and currently visible areas.
+
+    Objects are identified by positive indices, 0 in cover map is background.
+    Visible part of every object is also kept as RLEMask, these masks are the final labels.
+    """
+
+    def __init__(self, shape, max_objects):
+        dtype = np.uint16 if max_objects < np.iinfo(np.uint16).max else np.int32
+        self.cover = np.zeros(shape, dtype)  # size is (h, w)
+        self.original = np.zeros(max_objects + 1, np.int64)
+        self.current = np.zeros(max_objects + 1, np.int64)
+        self.visible = {}  # object index -> RLEMask
+
+    def count_covered(self, mask: np.ndarray, x, y) -> np.ndarray:
+        """Number of visible pixels of every placed object that the mask at (x, y) would cover"""
+        h, w = mask.shape
+        crop = self.cover[y:y + h, x:x + w]
+        covered = np.bincount(crop[mask], minlength=len(self.current))
+        covered[0] = 0
+        return covered
+
+    def is_visible(self, covered: np.ndarray, threshold) -> bool:
+        """Checks that every placed object keeps at least threshold portion of its area visible"""
+        ids = np.flatnonzero(covered)
+        if len(ids) == 0:
+            return True
+        visibility_portion = (self.current[ids] - covered[ids]) / self.original[ids]
+        return bool(np.all(visibility_portion >= threshold))
+
+    def place(self, mask: np.ndarray, x, y, idx, covered: np.ndarray):
+        h, w = mask.shape
+        self.cover[y:y + h, x:x + w][mask] = idx
+        self.current -= covered
+        placed = RLEMask.from_mask(mask, y, x, self.cover.shape)
+        for covered_idx in np.flatnonzero(covered):
+            self.visible[covered_idx] = self.visible[covered_idx].subtract(placed)
+        self.visible[idx] = placed
+        self.current[idx] = placed.area
+        self.original[idx] = placed.area
+
+    def union(self) -> RLEMask:
+        """Area covered by all placed objects"""
+        return rle.union_all(self.visible.values(), self.cover.shape)
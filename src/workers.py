@@ -0,0 +1,112 @@
+import os
+import multiprocessing
+import multiprocessing.util
+from collections import deque
+import supervisely as sly
+
+import aug
+import globals as g
+from backgrounds import BackgroundProvider
+from caches import backgrounds_cache_bytes
+from generate import synthesize
+
+# worker process state, filled by _init_worker
+_api: sly.Api = None
+_state = None
+_plan: aug.AugPlan = None
+_backgrounds: BackgroundProvider = None
+_cache_dir = None
+
+
+class _QueuedBackgrounds:
+    """Backgrounds drawn from the catalogue by the parent process and read by workers from a queue"""
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def sample(self):
+        return self._queue.get()
+
+
+def get_workers_count(state):
+    workers = state.get("workersCount") or 1
+    return max(1, min(int(workers), os.cpu_count() or 1))
+
+
+def _init_worker(server_address, token, state, cache_dir, workers, bg_queue, prefetch):
+    global _api, _state, _plan, _backgrounds, _cache_dir
+    # every worker owns its api session and background provider, compiled augmentations
+    # and foreground data (g.sampling_index, g.sprite_bank) are inherited from the parent by fork
+    _api = sly.Api(server_address, token)
+    _state = state
+    g.sprite_bank.set_sources(_api, g.images_info, g.label_store, g.image_cache)
+    _backgrounds = BackgroundProvider(
+        _api, g.image_cache, max_bytes=backgrounds_cache_bytes // workers, prefetch=prefetch
+    )
+    _backgrounds.set_images(_QueuedBackgrounds(bg_queue))
+    # downloads in progress are finished before the worker exits, no partial files are left in the image cache
+    multiprocessing.util.Finalize(None, _backgrounds.close, exitpriority=10)
+    _cache_dir = cache_dir
+
+    # forked workers share the parent random state, reseed to get different images
+    aug.reseed()
+    _plan = aug.compile_plan(state["augs"])
+
+
+def _synthesize_in_worker():
+    img, ann, meta = synthesize(
+        _api, None, _state, _plan, g.meta, g.sprite_bank, g.sampling_index, _backgrounds, _cache_dir, preview=False,
+        progress_reporter=g.progress_reporter
+    )
+    # pickled as objects, json would encode and decode every bitmap
+    return img, ann, meta
+
+
+def synthesize_images(api: sly.Api, task_id, state, bg_images, cache_dir, count):
+    """Yields (img, ann, meta) for every generated image in order.
+
+    With one worker images are synthesized in the current process, otherwise
+    a pool of forked processes is used and results are returned in submission order.
+    Backgrounds for workers are drawn here and sent to a shared queue ahead of submitted
+    tasks, so every worker prefetches its next backgrounds and images listed by the
+    catalogue after the pool has started are used too. There are no more workers than
+    images and no worker prefetches more backgrounds than its share of images.
+    """
+    workers = min(get_workers_count(state), count)
+    plan = aug.compile_plan(state["augs"])
+    if workers <= 1:
+        g.backgrounds.set_images(bg_images)
+        for _ in range(count):
+            yield synthesize(
+                api, task_id, state, plan, g.meta, g.sprite_bank, g.sampling_index, g.backgrounds, cache_dir, preview=False,
+                progress_reporter=g.progress_reporter
+            )
+        return
+
+    sly.logger.info(f"Generate images with {workers} workers")
+    g.progress_reporter.clear_workers()
+    ctx = multiprocessing.get_context("fork")
+    bg_queue = ctx.Queue()
+    prefetch = min(BackgroundProvider.default_prefetch, -(-count // workers) - 1)
+    initargs = (api.server_address, api.token, state, cache_dir, workers, bg_queue, prefetch)
+    try:
+        with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            # every worker holds its current background and up to prefetch upcoming ones,
+            # with one more background per submitted task the queue never runs dry
+            for _ in range(workers * prefetch):
+                bg_queue.put(bg_images.sample())
+            pending = deque()
+            submitted = 0
+            while submitted < count or len(pending) > 0:
+                while submitted < count and len(pending) < 2 * workers:
+                    pending.append(pool.apply_async(_synthesize_in_worker))
+                    bg_queue.put(bg_images.sample())
+                    submitted += 1
+                yield pending.popleft().get()
+            # workers stop their background providers on exit, terminate would kill downloads
+            pool.close()
+            pool.join()
+    finally:
+        # backgrounds left in the queue are not needed
+        bg_queue.close()
+        bg_queue.cancel_join_thread()
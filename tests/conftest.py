@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app modules are imported by name from src, as in the app itself
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+import aug
+
+
+def random_layer(rng, bg_shape):
+    h, w = int(rng.integers(5, 60)), int(rng.integers(5, 60))
+    fg = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    mask = np.zeros((h, w), np.uint8)
+    cv2.ellipse(mask, (w // 2, h // 2), (max(w // 2 - 1, 1), max(h // 2 - 1, 1)), 0, 0, 360, 255, -1)
+    if rng.random() < 0.3:
+        mask[rng.random((h, w)) < 0.2] = 0
+    ksize = int(rng.choice([0, 0, 3, 4, 7]))
+    opacity = 1.0 if rng.random() < 0.5 else float(rng.uniform(0.5, 1.0))
+    x, y = int(rng.integers(0, bg_shape[1] - w + 1)), int(rng.integers(0, bg_shape[0] - h + 1))
+    return fg, mask, x, y, ksize, opacity
+
+
+def test_composite_layers_equals_sequential_placement():
+    for seed in range(300):
+        rng = np.random.default_rng(seed)
+        bg = rng.integers(0, 256, (80, 100, 3), dtype=np.uint8)
+        layers = [random_layer(rng, bg.shape) for _ in range(int(rng.integers(1, 15)))]
+
+        sequential = bg.copy()
+        for fg, mask, x, y, ksize, opacity in layers:
+            aug.place_fg_to_bg(fg, mask, sequential, x, y, edge_smoothing_ksize=ksize, opacity=opacity)
+
+        deferred = bg.copy()
+        aug.composite_layers(
+            deferred, [(fg, aug.get_alpha(mask, ksize, opacity), x, y) for fg, mask, x, y, ksize, opacity in layers]
+        )
+        assert np.array_equal(deferred, sequential), f"seed {seed}"
@@ -0,0 +1,111 @@
+import threading
+import types
+from collections import namedtuple
+import pytest
+import supervisely as sly
+
+from bg_catalogue import BackgroundCatalogue
+
+ImageInfo = namedtuple("ImageInfo", ["id", "name", "height", "width"])
+
+obj_class = sly.ObjClass("obj", sly.Polygon)
+meta = sly.ProjectMeta(obj_classes=sly.ObjClassCollection([obj_class]))
+
+
+def make_pages(pages_count, page_size):
+    return [
+        [ImageInfo(100 * page + idx + 1, f"{page}_{idx}.jpg", 200 + idx, 300 + page) for idx in range(page_size)]
+        for page in range(pages_count)
+    ]
+
+
+def labels_count(image_id):
+    return image_id % 3
+
+
+class FakeApi:
+    """Lists pages of one dataset, every page waits for release() before it is returned"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self._gate = threading.Semaphore(0)
+        self.dataset = types.SimpleNamespace(get_info_by_name=lambda project_id, name: types.SimpleNamespace(id=7))
+        self.image = types.SimpleNamespace(get_list_generator=self._get_list_generator)
+        self.annotation = types.SimpleNamespace(download_batch=self._download_batch)
+
+    def release(self, pages=1):
+        for _ in range(pages):
+            self._gate.release()
+
+    def _get_list_generator(self, dataset_id, batch_size):
+        for page in self.pages:
+            self._gate.acquire()
+            yield page
+
+    def _download_batch(self, dataset_id, image_ids):
+        ann_infos = []
+        for image_id in image_ids:
+            labels = [
+                sly.Label(sly.Polygon([(0, 10 * idx), (20, 10 * idx), (20, 10 * idx + 5)]), obj_class)
+                for idx in range(labels_count(image_id))
+            ]
+            ann_infos.append(types.SimpleNamespace(annotation=sly.Annotation((100, 100), labels).to_json()))
+        return ann_infos
+
+
+def wait_until(catalogue: BackgroundCatalogue, predicate):
+    with catalogue._changed:
+        assert catalogue._changed.wait_for(predicate, timeout=10)
+
+
+def test_wait_for_first_returns_before_listing_finishes():
+    api = FakeApi(make_pages(3, 4))
+    catalogue = BackgroundCatalogue(api, 1, ["bg"], page_size=4)
+    api.release()
+    assert catalogue.wait_for_first(timeout=10) == 4
+    assert not catalogue.done
+    api.release(2)
+    assert catalogue.wait() == 12
+
+
+def test_len_grows_page_by_page():
+    api = FakeApi(make_pages(3, 4))
+    catalogue = BackgroundCatalogue(api, 1, ["bg"], page_size=4)
+    assert len(catalogue) == 0
+    for pages in range(1, 4):
+        api.release()
+        wait_until(catalogue, lambda: len(catalogue) >= 4 * pages)
+        assert len(catalogue) == 4 * pages
+    assert catalogue.wait() == 12
+    assert catalogue.done and not catalogue.failed
+
+
+def test_get_and_sample_return_only_listed_rows():
+    pages = make_pages(2, 4)
+    api = FakeApi(pages)
+    catalogue = BackgroundCatalogue(api, 1, ["bg"], page_size=4)
+    api.release()
+    catalogue.wait_for_first(timeout=10)
+
+    listed = {info.id for info in pages[0]}
+    assert {catalogue.sample().id for _ in range(100)} == listed
+    with pytest.raises(IndexError):
+        catalogue.get(4)
+    api.release()
+    catalogue.wait()
+
+
+def test_growth_keeps_rows_and_labels():
+    pages = make_pages(3, 4)
+    api = FakeApi(pages)
+    api.release(3)
+    catalogue = BackgroundCatalogue(api, 1, ["bg"], meta=meta, page_size=4, chunk_size=3)
+    assert catalogue.wait() == 12
+
+    for index, info in enumerate(info for page in pages for info in page):
+        ref = catalogue.get(index)
+        assert (ref.id, ref.name, ref.height, ref.width) == (info.id, f"{info.id}.jpg", info.height, info.width)
+        assert len(ref.labels) == labels_count(info.id)
+        for idx, label in enumerate(ref.labels):
+            assert isinstance(label.geometry, sly.Bitmap)
+            assert label.geometry.to_bbox().left == 10 * idx
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import rle
+from rle import RLEMask
+
+img_size = (37, 53)
+
+
+def random_masks(seed, count=2):
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(count):
+        # blocks of random size, so masks have both long runs and single pixels
+        block = int(rng.integers(1, 8))
+        small = rng.random((img_size[0] // block + 1, img_size[1] // block + 1)) < rng.uniform(0.1, 0.9)
+        masks.append(np.kron(small, np.ones((block, block), bool))[:img_size[0], :img_size[1]])
+    return masks
+
+
+def to_dense(mask: RLEMask) -> np.ndarray:
+    dense = np.zeros(mask.img_size, bool)
+    bitmap = mask.to_bitmap()
+    if bitmap is not None:
+        top, left = bitmap.origin.row, bitmap.origin.col
+        h, w = bitmap.data.shape
+        dense[top:top + h, left:left + w] = bitmap.data
+    return dense
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_set_operations_match_dense(seed):
+    a, b = random_masks(seed)
+    rle_a, rle_b = RLEMask.from_mask(a, 0, 0, img_size), RLEMask.from_mask(b, 0, 0, img_size)
+    assert np.array_equal(to_dense(rle_a), a)
+    assert rle_a.area == a.sum()
+    assert rle_a.is_empty() == (not a.any())
+    assert np.array_equal(to_dense(rle_a.union(rle_b)), a | b)
+    assert np.array_equal(to_dense(rle_a.intersect(rle_b)), a & b)
+    assert np.array_equal(to_dense(rle_a.subtract(rle_b)), a & ~b)
+    assert rle_a.subtract(rle_b).area == (a & ~b).sum()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_union_all_matches_dense(seed):
+    masks = random_masks(seed, count=int(seed % 5))
+    expected = np.zeros(img_size, bool)
+    for mask in masks:
+        expected |= mask
+    union = rle.union_all([RLEMask.from_mask(mask, 0, 0, img_size) for mask in masks], img_size)
+    assert np.array_equal(to_dense(union), expected)
+    assert union.area == expected.sum()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_from_mask_at_offset(seed):
+    rng = np.random.default_rng(seed)
+    mask = rng.random((int(rng.integers(1, 20)), int(rng.integers(1, 30)))) < 0.5
+    top, left = int(rng.integers(0, img_size[0] - mask.shape[0])), int(rng.integers(0, img_size[1] - mask.shape[1]))
+    expected = np.zeros(img_size, bool)
+    expected[top:top + mask.shape[0], left:left + mask.shape[1]] = mask
+    assert np.array_equal(to_dense(RLEMask.from_mask(mask, top, left, img_size)), expected)
+
+
+def test_empty_masks():
+    empty = RLEMask.from_mask(np.zeros(img_size, bool), 0, 0, img_size)
+    full = RLEMask.from_mask(np.ones(img_size, bool), 0, 0, img_size)
+    assert empty.is_empty() and empty.to_bitmap() is None
+    assert full.subtract(full).is_empty()
+    assert full.intersect(empty).is_empty()
+    assert full.union(empty).area == img_size[0] * img_size[1]
+    assert rle.union_all([], img_size).is_empty()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_encode_decode_round_trip(seed):
+    mask = random_masks(seed, count=1)[0]
+    runs = rle.encode(mask)
+    assert runs.sum() == mask.size
+    assert np.array_equal(rle.decode(runs, mask.shape), mask)
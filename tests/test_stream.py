@@ -0,0 +1,98 @@
+import os
+import types
+from collections import namedtuple
+import cv2
+import numpy as np
+import pytest
+import supervisely as sly
+
+import stream
+
+ImageInfo = namedtuple("ImageInfo", ["id", "name", "hash", "height", "width"])
+
+obj_class = sly.ObjClass("obj", sly.Polygon)
+meta = sly.ProjectMeta(obj_classes=sly.ObjClassCollection([obj_class]))
+source_ids = [1, 2, 3]
+background_ids = [101, 102, 103, 104]
+
+
+class FakeApi:
+    """Foreground project 1 with one dataset of labeled images, background project 2 with one dataset"""
+
+    server_address = "http://localhost"
+    token = "token"
+
+    def __init__(self):
+        self.project = types.SimpleNamespace(get_meta=lambda project_id: meta.to_json())
+        self.dataset = types.SimpleNamespace(get_list=self._get_datasets, get_info_by_name=self._get_dataset)
+        self.image = types.SimpleNamespace(
+            get_list=lambda dataset_id: [ImageInfo(i, f"{i}.png", None, 120, 160) for i in source_ids],
+            get_list_generator=self._get_list_generator,
+            download_path=self._download_path,
+        )
+        self.annotation = types.SimpleNamespace(download_batch=self._download_batch)
+
+    def _get_datasets(self, project_id):
+        return [types.SimpleNamespace(id=10 * project_id, name="ds", items_count=len(source_ids), updated_at="t")]
+
+    def _get_dataset(self, project_id, name):
+        return types.SimpleNamespace(id=10 * project_id)
+
+    def _get_list_generator(self, dataset_id, batch_size):
+        yield [ImageInfo(i, f"{i}.jpg", None, 240, 320) for i in background_ids]
+
+    def _download_path(self, image_id, path):
+        rng = np.random.default_rng(image_id)
+        shape = (120, 160, 3) if image_id in source_ids else (240, 320, 3)
+        cv2.imwrite(path, rng.integers(0, 256, shape, dtype=np.uint8))
+
+    def _download_batch(self, dataset_id, image_ids):
+        label = sly.Label(sly.Polygon([(10, 10), (10, 90), (100, 60)]), obj_class)
+        return [types.SimpleNamespace(annotation=sly.Annotation((120, 160), [label]).to_json()) for _ in image_ids]
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    api = FakeApi()
+    root = tmp_path_factory.mktemp("stream")
+    with open(os.path.join(os.path.dirname(stream.__file__), "augs.yaml")) as file:
+        augs = file.read()
+    state = {
+        "selectedClasses": ["obj"], "backgroundLabels": "ignore", "taskType": "inst-seg", "augs": augs,
+        "bgProjectId": 2, "bgDatasets": ["ds"], "allDatasets": False,
+    }
+    patch = pytest.MonkeyPatch()
+    patch.setattr(stream.sly, "Api", lambda *args, **kwargs: api)
+    yield stream.SyntheticDataset(api, state, 1, str(root / "data"), str(root / "cache"), seed=7)
+    patch.undo()
+
+
+def take(dataset, monkeypatch, worker_id, count=3):
+    worker_info = types.SimpleNamespace(id=worker_id, num_workers=2)
+    monkeypatch.setattr(stream, "get_worker_info", lambda: worker_info)
+    samples = iter(dataset)
+    return [next(samples) for _ in range(count)]
+
+
+def same(samples, other):
+    return all(np.array_equal(a, b) for sample, other_sample in zip(samples, other) for a, b in zip(sample, other_sample))
+
+
+def test_fixed_seed_reproduces_stream(dataset, monkeypatch):
+    samples = take(dataset, monkeypatch, worker_id=0)
+    img, class_map, instance_map = samples[0]
+    assert img.shape[:2] == class_map.shape == instance_map.shape
+    assert same(samples, take(dataset, monkeypatch, worker_id=0))
+
+
+def test_workers_get_different_streams(dataset, monkeypatch):
+    assert not same(take(dataset, monkeypatch, worker_id=0), take(dataset, monkeypatch, worker_id=1))
+
+
+def test_epochs_get_different_streams(dataset, monkeypatch):
+    first = take(dataset, monkeypatch, worker_id=0)
+    dataset.set_epoch(1)
+    try:
+        assert not same(first, take(dataset, monkeypatch, worker_id=0))
+    finally:
+        dataset.set_epoch(0)
@@ -0,0 +1,104 @@
+from collections import defaultdict
+import numpy as np
+import supervisely as sly
+
+from visibility import VisibilityTracker
+
+
+def count_visibility(cover_img, bitmap: sly.Bitmap, idx, x, y):
+    """Original implementation from generate.py, kept as reference"""
+    sec_h, sec_w = bitmap._data.shape
+    crop = cover_img[y:y + sec_h, x:x + sec_w].copy()
+    before_values, before_counts = np.unique(crop, return_counts=True)
+    difference = {}
+    for value, count in zip(before_values, before_counts):
+        if value == 0:
+            continue
+        difference[value] = count
+
+    crop[bitmap._data] = idx
+    after_values, after_counts = np.unique(crop, return_counts=True)
+    for value, count in zip(after_values, after_counts):
+        if value == 0 or value == idx:
+            continue
+        difference[value] -= count
+        if difference[value] < 0:
+            raise ValueError("Impossible difference")
+        if difference[value] == 0:
+            difference.pop(value)
+
+    return difference
+
+
+def random_mask(rng, max_side=60):
+    h, w = rng.integers(3, max_side, size=2)
+    mask = rng.random((h, w)) < rng.uniform(0.3, 0.9)
+    # pixels on every border, so sly.Bitmap keeps the mask shape
+    mask[0, 0] = mask[-1, -1] = True
+    return mask
+
+
+def test_same_results_as_count_visibility():
+    rng = np.random.default_rng(0)
+    shape, count, threshold = (120, 160), 300, 0.7
+    tracker = VisibilityTracker(shape, count)
+    cover = np.zeros(shape, np.int32)
+    objects_area = defaultdict(lambda: defaultdict(float))
+    placed = 0
+    for idx in range(1, count + 1):
+        mask = random_mask(rng)
+        h, w = mask.shape
+        x, y = int(rng.integers(0, shape[1] - w + 1)), int(rng.integers(0, shape[0] - h + 1))
+        bitmap = sly.Bitmap(mask, origin=sly.PointLocation(row=y, col=x))
+
+        difference = count_visibility(cover, bitmap, idx, x, y)
+        covered = tracker.count_covered(mask, x, y)
+        assert {int(i): int(covered[i]) for i in np.flatnonzero(covered)} == difference
+
+        allow_placement = all(
+            (objects_area[object_idx]["current"] - diff) / objects_area[object_idx]["original"] >= threshold
+            for object_idx, diff in difference.items()
+        )
+        assert tracker.is_visible(covered, threshold) == allow_placement
+        if not allow_placement:
+            continue
+
+        bitmap.draw(cover, color=idx)
+        for object_idx, diff in difference.items():
+            objects_area[object_idx]["current"] -= diff
+        objects_area[idx]["current"] = objects_area[idx]["original"] = bitmap.area
+        tracker.place(mask, x, y, idx, covered)
+        placed += 1
+
+        assert np.array_equal(tracker.cover, cover)
+        for object_idx, area in objects_area.items():
+            assert tracker.current[object_idx] == area["current"]
+            assert tracker.original[object_idx] == area["original"]
+
+    # both accepted and rejected placements are checked
+    assert 0 < placed < count
+
+
+def test_visible_masks_match_cover_map():
+    rng = np.random.default_rng(1)
+    shape, count = (90, 110), 200
+    tracker = VisibilityTracker(shape, count)
+    for idx in range(1, count + 1):
+        mask = random_mask(rng, max_side=40)
+        h, w = mask.shape
+        x, y = int(rng.integers(0, shape[1] - w + 1)), int(rng.integers(0, shape[0] - h + 1))
+        covered = tracker.count_covered(mask, x, y)
+        if tracker.is_visible(covered, 0.3):
+            tracker.place(mask, x, y, idx, covered)
+
+    assert len(tracker.visible) > 0
+    for idx, visible in tracker.visible.items():
+        dense = np.zeros(shape, bool)
+        bitmap = visible.to_bitmap()
+        if bitmap is not None:
+            top, left = bitmap.origin.row, bitmap.origin.col
+            dense[top:top + bitmap.data.shape[0], left:left + bitmap.data.shape[1]] = bitmap.data
+        assert np.array_equal(dense, tracker.cover == idx)
+        assert visible.area == tracker.current[idx]
+    union = tracker.union()
+    assert union.area == np.count_nonzero(tracker.cover)